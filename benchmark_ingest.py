@@ -0,0 +1,177 @@
+#!/usr/bin/python3
+
+import argparse
+import contextlib
+import os
+import sys
+import threading
+import time
+
+# The listener must not start its own MQTT worker, the benchmark feeds on_message itself
+os.environ['MQTT_INGEST'] = 'off'
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mqtt-listener'))
+
+import paho.mqtt.client as mqtt
+import health_codec
+import health_data_api
+from fake_mqtt_broker import FakeMQTTBroker
+from mqtt_publisher import MQTTHealthDataPublisher, MQTT_PROTOCOLS
+
+DATA_TYPES = ("raw_scale_data", "blood_pressure", "body_composition")
+
+BODY_DATA = {
+    "weight": 75.5, "bmi": 23.4, "body_fat_percent": 18.5, "muscle_mass": 58.2,
+    "bone_mass": 3.1, "water_percent": 55.3, "physique_rating": 5, "visceral_fat": 7,
+    "metabolic_age": 28, "bmr": 1650, "lbm": 61.5, "ideal_weight": 72.5,
+    "fat_mass_to_ideal": "to_lose:3.0", "protein_percent": 17.8, "impedance": 500
+}
+
+def make_measurements(data_type, count, users=10):
+    """Return count publish_many measurements of data_type spread over users (or devices)."""
+    start = int(time.time()) - count
+    measurements = []
+    for index in range(count):
+        if data_type == "raw_scale_data":
+            measurements.append({"type": data_type, "device_mac": f"AA:BB:CC:DD:EE:{index % users:02X}",
+                                 "timestamp": start + index, "weight": 70 + index % 100 / 10,
+                                 "impedance": 450 + index % 50, "battery_v": 3.0, "battery_percent": 80})
+        elif data_type == "blood_pressure":
+            measurements.append({"type": data_type, "user_email": f"user{index % users}@example.com",
+                                 "timestamp": start + index, "systolic": 110 + index % 40,
+                                 "diastolic": 70 + index % 20, "pulse": 60 + index % 30,
+                                 "category": "Normal", "mov": 0, "ihb": 0})
+        else:
+            measurements.append({"type": data_type, "user_email": f"user{index % users}@example.com",
+                                 "timestamp": start + index, "data": dict(BODY_DATA, weight=70 + index % 100 / 10)})
+    return measurements
+
+def percentile(samples, q):
+    """Return the q quantile (0..1) of a sorted list, None if it is empty."""
+    if not samples:
+        return None
+    return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+class IngestProbe:
+    """MQTT subscriber that hands every message to health_data_api.on_message and times it.
+
+    Latency is measured from the trace "sent" time stamped by the publisher
+    to the return of on_message, i.e. until the reading is visible in the
+    REST API store. CPU is the thread time spent inside on_message.
+    """
+
+    def __init__(self, broker_port, protocol, expected):
+        self.expected = expected
+        self.latencies = []
+        self.listener_cpu = 0.0
+        self.last_received = None
+        self.done = threading.Event()
+        try:
+            self.client = mqtt.Client(callback_api_version=mqtt.CallbackAPIVersion.VERSION1, protocol=protocol)
+        except AttributeError:
+            self.client = mqtt.Client(protocol=protocol)
+        self.client.on_message = self._on_message
+        self.client.connect('127.0.0.1', broker_port, 60)
+        self.client.subscribe('health/#')
+        self.client.loop_start()
+
+    def _on_message(self, client, userdata, msg):
+        cpu_start = time.thread_time()
+        health_data_api.on_message(client, userdata, msg)
+        self.last_received = time.time()
+        self.listener_cpu += time.thread_time() - cpu_start
+
+        sent = health_codec.decode_payload(msg.payload).get('trace', {}).get('sent')
+        if sent is not None:
+            self.latencies.append(self.last_received - sent)
+        if len(self.latencies) >= self.expected:
+            self.done.set()
+
+    def stop(self):
+        self.client.loop_stop()
+        self.client.disconnect()
+
+
+def run_benchmark(data_type, count, rate, encoding, protocol, max_inflight, timeout=60):
+    """Publish count measurements at rate messages per second (0 = as fast as possible) and return the results."""
+    measurements = make_measurements(data_type, count)
+    with FakeMQTTBroker() as broker:
+        probe = IngestProbe(broker.port, MQTT_PROTOCOLS[protocol], count)
+        publisher = MQTTHealthDataPublisher(broker_port=broker.port, payload_encoding=encoding, protocol=protocol)
+        # Both sides print per message, keep that off the terminal but in the measurement
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            if not publisher.connect():
+                raise RuntimeError("publisher could not connect to the fake broker")
+            time.sleep(0.2)  # let the probe's SUBSCRIBE settle
+
+            cpu_start = time.process_time()
+            started = time.time()
+            if rate <= 0:
+                publisher.publish_many(measurements, max_inflight=max_inflight)
+            else:
+                # Publish in small bursts every 50 ms to hold the requested rate
+                burst = max(1, rate // 20)
+                for index in range(0, count, burst):
+                    publisher.publish_many(measurements[index:index + burst], max_inflight=max_inflight)
+                    delay = started + (index + burst) / rate - time.time()
+                    if delay > 0:
+                        time.sleep(delay)
+            probe.done.wait(timeout)
+            elapsed = (probe.last_received or time.time()) - started
+            cpu = time.process_time() - cpu_start
+
+            probe.stop()
+            publisher.disconnect()
+
+    latencies = sorted(probe.latencies)
+    received = len(latencies)
+    return {
+        "type": data_type,
+        "encoding": encoding,
+        "protocol": protocol,
+        "received": received,
+        "sent": count,
+        "wire_bytes": broker.bytes_received,
+        "msgs_per_sec": received / elapsed if elapsed > 0 else 0.0,
+        "p50_ms": percentile(latencies, 0.5) * 1000 if latencies else None,
+        "p99_ms": percentile(latencies, 0.99) * 1000 if latencies else None,
+        "cpu_us_per_msg": cpu / received * 1e6 if received else None,
+        "listener_cpu_us_per_msg": probe.listener_cpu / received * 1e6 if received else None,
+    }
+
+def print_results(results):
+    """Print one table row per benchmark run."""
+    def number(value, digits=1):
+        return "-" if value is None else f"{value:.{digits}f}"
+
+    print(f"{'type':<17} {'enc':<8} {'mqtt':<6} {'recv':>11} {'bytes/msg':>9} {'msg/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'cpu us':>8} {'api us':>8}")
+    for result in results:
+        per_message = result['wire_bytes'] / result['sent'] if result['sent'] else 0
+        print(f"{result['type']:<17} {result['encoding']:<8} {result['protocol']:<6} "
+              f"{result['received']:>5}/{result['sent']:<5} {per_message:>9.0f} {number(result['msgs_per_sec'], 0):>9} "
+              f"{number(result['p50_ms'], 2):>8} {number(result['p99_ms'], 2):>8} "
+              f"{number(result['cpu_us_per_msg'], 0):>8} {number(result['listener_cpu_us_per_msg'], 0):>8}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark MQTTHealthDataPublisher -> broker -> health_data_api.on_message without external services")
+    parser.add_argument("-n", "--count", type=int, default=2000, help="messages per run (default 2000)")
+    parser.add_argument("-r", "--rate", type=int, default=0, help="messages per second, 0 publishes as fast as possible (default)")
+    parser.add_argument("-t", "--type", nargs="+", choices=DATA_TYPES, default=list(DATA_TYPES), help="measurement types to run")
+    parser.add_argument("-e", "--encoding", nargs="+", choices=("json", "compact"), default=["json"], help="payload encodings to run")
+    parser.add_argument("-p", "--protocol", nargs="+", choices=tuple(MQTT_PROTOCOLS), default=["3.1.1"], help="MQTT protocol versions to run")
+    parser.add_argument("-w", "--max-inflight", type=int, default=20, help="publish_many in-flight window (default 20)")
+    args = parser.parse_args()
+
+    print("🏁 Ingest benchmark: MQTTHealthDataPublisher -> FakeMQTTBroker -> health_data_api.on_message")
+    print(f"   {args.count} messages per run, rate {'unlimited' if args.rate <= 0 else f'{args.rate} msg/s'}, window {args.max_inflight}")
+    print("   cpu us = whole process per message, api us = inside on_message per message\n")
+    results = []
+    for data_type in args.type:
+        for encoding in args.encoding:
+            for protocol in args.protocol:
+                results.append(run_benchmark(data_type, args.count, args.rate, encoding, protocol, args.max_inflight))
+    print_results(results)
+    return all(result['received'] == result['sent'] for result in results)
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
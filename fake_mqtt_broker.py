@@ -0,0 +1,310 @@
+#!/usr/bin/python3
+
+import socket
+import struct
+import threading
+
+# MQTT v5 property identifiers by value type, used to skip over properties
+PROPERTY_BYTE = {0x01, 0x17, 0x19, 0x24, 0x25, 0x28, 0x29, 0x2A}
+PROPERTY_INT2 = {0x13, 0x21, 0x22, 0x23}
+PROPERTY_INT4 = {0x02, 0x11, 0x18, 0x27}
+PROPERTY_VARINT = {0x0B}
+PROPERTY_STRING = {0x03, 0x08, 0x09, 0x12, 0x15, 0x16, 0x1A, 0x1C, 0x1F}
+PROPERTY_STRING_PAIR = {0x26}
+TOPIC_ALIAS = 0x23
+
+def _encode_varint(value):
+    out = bytearray()
+    while True:
+        byte = value % 128
+        value //= 128
+        if value:
+            byte |= 0x80
+        out.append(byte)
+        if not value:
+            return bytes(out)
+
+def _decode_varint(buffer, offset):
+    multiplier = 1
+    value = 0
+    while True:
+        byte = buffer[offset]
+        offset += 1
+        value += (byte & 0x7F) * multiplier
+        multiplier *= 128
+        if not byte & 0x80:
+            return value, offset
+
+def _split_properties(buffer):
+    """Return (properties without the topic alias, topic alias or None)."""
+    kept = bytearray()
+    alias = None
+    offset = 0
+    while offset < len(buffer):
+        start = offset
+        identifier = buffer[offset]
+        offset += 1
+        if identifier in PROPERTY_BYTE:
+            offset += 1
+        elif identifier in PROPERTY_INT2:
+            offset += 2
+        elif identifier in PROPERTY_INT4:
+            offset += 4
+        elif identifier in PROPERTY_VARINT:
+            value, offset = _decode_varint(buffer, offset)
+        elif identifier in PROPERTY_STRING:
+            offset += 2 + struct.unpack_from('>H', buffer, offset)[0]
+        elif identifier in PROPERTY_STRING_PAIR:
+            for _ in range(2):
+                offset += 2 + struct.unpack_from('>H', buffer, offset)[0]
+        else:
+            raise ValueError(f"unknown property {identifier:#x}")
+        if identifier == TOPIC_ALIAS:
+            alias, = struct.unpack_from('>H', buffer, start + 1)
+        else:
+            kept += buffer[start:offset]
+    return bytes(kept), alias
+
+def topic_matches(topic_filter, topic):
+    """Return True if topic matches an MQTT subscription filter with + and # wildcards."""
+    filter_parts = topic_filter.split('/')
+    topic_parts = topic.split('/')
+    for index, part in enumerate(filter_parts):
+        if part == '#':
+            return True
+        if index >= len(topic_parts) or (part != '+' and part != topic_parts[index]):
+            return False
+    return len(filter_parts) == len(topic_parts)
+
+
+class _Session:
+    """One client connection of FakeMQTTBroker."""
+
+    def __init__(self, broker, sock):
+        self.broker = broker
+        self.sock = sock
+        self.send_lock = threading.Lock()
+        self.protocol = 4
+        self.aliases = {}  # topic alias -> topic, set by this client
+
+    def send(self, packet):
+        with self.send_lock:
+            self.sock.sendall(packet)
+
+    def _recv_exactly(self, size):
+        data = bytearray()
+        while len(data) < size:
+            chunk = self.sock.recv(size - len(data))
+            if not chunk:
+                raise EOFError
+            data += chunk
+        return bytes(data)
+
+    def _read_packet(self):
+        header = self._recv_exactly(1)[0]
+        multiplier = 1
+        length = 0
+        while True:
+            byte = self._recv_exactly(1)[0]
+            length += (byte & 0x7F) * multiplier
+            multiplier *= 128
+            if not byte & 0x80:
+                break
+        return header, self._recv_exactly(length) if length else b''
+
+    def run(self):
+        try:
+            while True:
+                header, body = self._read_packet()
+                packet_type = header >> 4
+                if packet_type == 1:
+                    self._handle_connect(body)
+                elif packet_type == 3:
+                    self._handle_publish(header, body)
+                elif packet_type == 6:
+                    # PUBREL of a QoS 2 publish, answer with PUBCOMP
+                    self.send(b'\x70\x02' + body[:2])
+                elif packet_type == 8:
+                    self._handle_subscribe(body)
+                elif packet_type == 10:
+                    self._handle_unsubscribe(body)
+                elif packet_type == 12:
+                    self.send(b'\xd0\x00')
+                elif packet_type == 14:
+                    break
+        except (EOFError, OSError, ValueError, IndexError, struct.error):
+            pass
+        finally:
+            self.broker._remove_session(self)
+            self.sock.close()
+
+    def _handle_connect(self, body):
+        # Protocol name "MQTT" (2 + 4 bytes) is followed by the protocol level
+        self.protocol = body[6]
+        if self.protocol == 5:
+            properties = b'\x22' + struct.pack('>H', self.broker.topic_alias_maximum)
+            self.send(b'\x20' + _encode_varint(3 + len(properties)) + b'\x00\x00' + _encode_varint(len(properties)) + properties)
+        else:
+            self.send(b'\x20\x02\x00\x00')
+
+    def _handle_publish(self, header, body):
+        qos = (header >> 1) & 0x03
+        retain = bool(header & 0x01)
+        topic_length, = struct.unpack_from('>H', body, 0)
+        topic = body[2:2 + topic_length].decode('utf-8')
+        offset = 2 + topic_length
+        if qos:
+            packet_id = body[offset:offset + 2]
+            offset += 2
+        properties = b''
+        if self.protocol == 5:
+            length, offset = _decode_varint(body, offset)
+            properties, alias = _split_properties(body[offset:offset + length])
+            offset += length
+            if alias is not None:
+                if topic:
+                    self.aliases[alias] = topic
+                else:
+                    topic = self.aliases[alias]
+        payload = body[offset:]
+
+        if qos == 1:
+            self.send(b'\x40\x02' + packet_id)
+        elif qos == 2:
+            self.send(b'\x50\x02' + packet_id)
+        self.broker._route(topic, payload, properties, retain, len(body))
+
+    def _handle_subscribe(self, body):
+        packet_id = body[:2]
+        offset = 2
+        if self.protocol == 5:
+            length, offset = _decode_varint(body, offset)
+            offset += length
+        filters = []
+        while offset < len(body):
+            length, = struct.unpack_from('>H', body, offset)
+            filters.append(body[offset + 2:offset + 2 + length].decode('utf-8'))
+            offset += 3 + length  # filter and its options byte
+        granted = (b'\x00' if self.protocol == 5 else b'') + b'\x00' * len(filters)
+        self.send(b'\x90' + _encode_varint(2 + len(granted)) + packet_id + granted)
+        self.broker._subscribe(self, filters)
+
+    def _handle_unsubscribe(self, body):
+        packet_id = body[:2]
+        offset = 2
+        if self.protocol == 5:
+            length, offset = _decode_varint(body, offset)
+            offset += length
+        filters = []
+        while offset < len(body):
+            length, = struct.unpack_from('>H', body, offset)
+            filters.append(body[offset + 2:offset + 2 + length].decode('utf-8'))
+            offset += 2 + length
+        self.broker._unsubscribe(self, filters)
+        reasons = b'\x00' + b'\x00' * len(filters) if self.protocol == 5 else b''
+        self.send(b'\xb0' + _encode_varint(2 + len(reasons)) + packet_id + reasons)
+
+    def deliver(self, topic, payload, properties, retain=False):
+        """Forward a message to this client at QoS 0."""
+        topic_bytes = topic.encode('utf-8')
+        body = struct.pack('>H', len(topic_bytes)) + topic_bytes
+        if self.protocol == 5:
+            body += _encode_varint(len(properties)) + properties
+        body += payload
+        self.send(bytes([0x30 | int(retain)]) + _encode_varint(len(body)) + body)
+
+
+class FakeMQTTBroker:
+    """Minimal in-process MQTT broker for tests and benchmarks.
+
+    Speaks enough MQTT 3.1.1 and 5 for paho: CONNECT, PUBLISH at QoS 0-2
+    (acknowledged, then forwarded to subscribers at QoS 0), SUBSCRIBE with
+    + and # wildcards, retained messages, topic aliases and PINGREQ. There is
+    no authentication, no session state and no persistence.
+
+    with FakeMQTTBroker() as broker:
+        publisher = MQTTHealthDataPublisher(broker_port=broker.port)
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, topic_alias_maximum=10):
+        self.host = host
+        self.topic_alias_maximum = topic_alias_maximum
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind((host, port))
+        self.port = self._server.getsockname()[1]
+        self._lock = threading.Lock()
+        self._sessions = set()
+        self._subscriptions = []  # (session, topic filter)
+        self._retained = {}  # topic -> (payload, properties)
+        self.messages_received = 0
+        self.bytes_received = 0
+
+    def start(self):
+        """Start accepting connections in a background thread."""
+        self._server.listen()
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+        return self
+
+    def stop(self):
+        """Stop accepting connections and close all client connections."""
+        self._server.close()
+        with self._lock:
+            sessions = list(self._sessions)
+        for session in sessions:
+            try:
+                session.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _accept_loop(self):
+        while True:
+            try:
+                sock, address = self._server.accept()
+            except OSError:
+                return
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            session = _Session(self, sock)
+            with self._lock:
+                self._sessions.add(session)
+            threading.Thread(target=session.run, daemon=True).start()
+
+    def _remove_session(self, session):
+        with self._lock:
+            self._sessions.discard(session)
+            self._subscriptions = [entry for entry in self._subscriptions if entry[0] is not session]
+
+    def _subscribe(self, session, filters):
+        with self._lock:
+            self._subscriptions.extend((session, topic_filter) for topic_filter in filters)
+            retained = [(topic, payload, properties) for topic, (payload, properties) in self._retained.items()
+                        if any(topic_matches(topic_filter, topic) for topic_filter in filters)]
+        for topic, payload, properties in retained:
+            session.deliver(topic, payload, properties, retain=True)
+
+    def _unsubscribe(self, session, filters):
+        with self._lock:
+            self._subscriptions = [entry for entry in self._subscriptions
+                                   if entry[0] is not session or entry[1] not in filters]
+
+    def _route(self, topic, payload, properties, retain, size):
+        with self._lock:
+            self.messages_received += 1
+            self.bytes_received += size
+            if retain:
+                if payload:
+                    self._retained[topic] = (payload, properties)
+                else:
+                    self._retained.pop(topic, None)
+            targets = {session for session, topic_filter in self._subscriptions if topic_matches(topic_filter, topic)}
+        for session in targets:
+            try:
+                session.deliver(topic, payload, properties)
+            except OSError:
+                pass
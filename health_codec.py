@@ -0,0 +1,299 @@
+#!/usr/bin/python3
+
+import json
+import math
+import struct
+from datetime import date, datetime, timedelta, timezone
+
+# Compact payload layout (all integers big endian):
+#   magic (0xC5), codec version, schema id, flags,
+#   timestamp (uint32 seconds since epoch), UTC offset (int16 minutes),
+#   identity (uint8 length + UTF-8 user email or device MAC),
+#   presence bitmap (uint16, bit n set when schema field n is present),
+#   present field values in schema order,
+#   with FLAG_TRACE: trace read and sent times (float64 seconds, NaN if unknown).
+# Compact messages are published on the JSON topic plus COMPACT_TOPIC_SUFFIX,
+# so subscribers that do not know the codec never receive them.
+# decoded payloads also carry the timestamp as Unix seconds under EPOCH_KEY,
+# so the listener does not have to parse the ISO string back.
+COMPACT_MAGIC = 0xC5
+COMPACT_VERSION = 1
+COMPACT_TOPIC_SUFFIX = f"/c{COMPACT_VERSION}"
+
+# MQTT v5 ContentType of each encoding, and the version of the payload
+# layout sent as the "schema" user property
+CONTENT_TYPE_JSON = "application/json"
+CONTENT_TYPE_COMPACT = f"application/x-healthdata-c{COMPACT_VERSION}"
+PAYLOAD_SCHEMA_VERSION = 1
+
+HEADER = struct.Struct('>BBBBIh')
+BITMAP = struct.Struct('>H')
+TRACE = struct.Struct('>dd')
+TRACE_KEYS = ("read", "sent")
+FLOAT32 = struct.Struct('>f')
+UINT32 = struct.Struct('>I')
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+EPOCH_KEY = "epoch"
+
+# Header flags
+FLAG_TZ_AWARE = 0x01  # timestamp carried an explicit UTC offset
+FLAG_TRACE = 0x02     # payload ends with the latency trace
+
+# Field kinds: f = float32, H = uint16, ? = bool, s = uint8 length + UTF-8
+FIELD_STRUCTS = {
+    'f': struct.Struct('>f'),
+    'H': struct.Struct('>H'),
+    '?': struct.Struct('>?'),
+}
+
+# Schema per message type: (schema id, identity key, ((field, kind), ...)).
+# Fields may only be appended to a schema; a changed or removed field needs
+# a new schema id or codec version.
+SCHEMAS = {
+    "body_composition": (1, "user", (
+        ("weight", 'f'),
+        ("bmi", 'f'),
+        ("body_fat_percent", 'f'),
+        ("muscle_mass", 'f'),
+        ("bone_mass", 'f'),
+        ("water_percent", 'f'),
+        ("physique_rating", 'f'),
+        ("visceral_fat", 'f'),
+        ("metabolic_age", 'f'),
+        ("bmr", 'f'),
+        ("lbm", 'f'),
+        ("ideal_weight", 'f'),
+        ("fat_mass_to_ideal", 's'),
+        ("protein_percent", 'f'),
+        ("impedance", 'f'),
+    )),
+    "blood_pressure": (2, "user", (
+        ("systolic", 'H'),
+        ("diastolic", 'H'),
+        ("pulse", 'H'),
+        ("category", 's'),
+        ("movement_detected", '?'),
+        ("irregular_heartbeat", '?'),
+    )),
+    "raw_scale_data": (3, "device", (
+        ("weight", 'f'),
+        ("impedance", 'f'),
+        ("battery_voltage", 'f'),
+        ("battery_percent", 'f'),
+    )),
+}
+SCHEMAS_BY_ID = {schema_id: (data_type, identity_key, fields)
+                 for data_type, (schema_id, identity_key, fields) in SCHEMAS.items()}
+
+def _pack_string(value):
+    raw = value.encode('utf-8')
+    if len(raw) > 255:
+        raise ValueError("string longer than 255 bytes")
+    return bytes([len(raw)]) + raw
+
+def _unpack_string(buffer, offset):
+    length = buffer[offset]
+    offset += 1
+    return buffer[offset:offset + length].decode('utf-8'), offset + length
+
+def _pack_value(kind, value):
+    if kind == 's':
+        if not isinstance(value, str):
+            raise TypeError("expected a string")
+        return _pack_string(value)
+    if kind == '?':
+        if not isinstance(value, bool):
+            raise TypeError("expected a bool")
+    elif isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise TypeError("expected a number")
+    elif kind != 'f' and value != int(value):
+        raise ValueError("expected an integer")
+    elif kind != 'f':
+        value = int(value)
+    return FIELD_STRUCTS[kind].pack(value)
+
+def _round_float32(value):
+    """Round a float32 to 6 significant digits, dropping the binary noise (23.399999618530273 -> 23.4)."""
+    if value == 0:
+        return 0
+    if not math.isfinite(value):
+        return value
+    digits = 5 - math.floor(math.log10(abs(value)))
+    if digits > 22:
+        value = round(value, digits)  # 10.0 ** digits is no longer exact
+    elif digits > 0:
+        scale = 10.0 ** digits
+        value = round(value * scale) / scale
+    else:
+        scale = 10 ** -digits
+        return round(value / scale) * scale
+    return int(value) if value.is_integer() else value
+
+FLOAT_CACHE_SIZE = 65536
+_FLOAT_VALUES = {}  # {float32 bit pattern: rounded value}, readings repeat the same values
+
+def _float_value(bits):
+    value = _round_float32(FLOAT32.unpack(UINT32.pack(bits))[0])
+    if len(_FLOAT_VALUES) >= FLOAT_CACHE_SIZE:
+        _FLOAT_VALUES.clear()
+    _FLOAT_VALUES[bits] = value
+    return value
+
+_DECODERS = {}  # {(schema id, bitmap): steps}, see _decoder()
+
+def _decoder(schema_id, bitmap):
+    """Return the steps to unpack the present fields of a schema.
+
+    Each run of fixed-size fields is one (struct, names, float positions)
+    step, unpacked in one call, floats as their uint32 bit pattern; a
+    string field is a (None, name, None) step. Built once per schema and
+    bitmap.
+    """
+    key = (schema_id, bitmap)
+    steps = _DECODERS.get(key)
+    if steps is not None:
+        return steps
+    steps = []
+    names, formats = [], ''
+    for index, (name, kind) in enumerate(SCHEMAS_BY_ID[schema_id][2]):
+        if not bitmap & (1 << index):
+            continue
+        if kind != 's':
+            names.append(name)
+            formats += kind
+            continue
+        if names:
+            steps.append(_fixed_step(names, formats))
+            names, formats = [], ''
+        steps.append((None, name, None))
+    if names:
+        steps.append(_fixed_step(names, formats))
+    _DECODERS[key] = steps
+    return steps
+
+def _fixed_step(names, formats):
+    return (struct.Struct('>' + formats.replace('f', 'I')), tuple(names),
+            tuple(position for position, kind in enumerate(formats) if kind == 'f'))
+
+DATE_CACHE_SIZE = 4096
+_DATES = {}  # {days since epoch: "YYYY-MM-DD"}
+_UTC_OFFSETS = {}  # {minutes: "+HH:MM"}
+_CLOCK_MINUTES = [f"T{minute // 60:02d}:{minute % 60:02d}:" for minute in range(24 * 60)]
+_CLOCK_SECONDS = [f"{second:02d}" for second in range(60)]
+
+def _isoformat(seconds, offset_minutes, aware):
+    """Return datetime.isoformat() of a Unix time at a UTC offset, without building a datetime."""
+    days, rest = divmod(seconds + offset_minutes * 60, 86400)
+    day = _DATES.get(days)
+    if day is None:
+        if len(_DATES) >= DATE_CACHE_SIZE:
+            _DATES.clear()
+        day = _DATES[days] = date.fromordinal(EPOCH_ORDINAL + days).isoformat()
+    minute, second = divmod(rest, 60)
+    timestamp = day + _CLOCK_MINUTES[minute] + _CLOCK_SECONDS[second]
+    if not aware:
+        return timestamp
+    suffix = _UTC_OFFSETS.get(offset_minutes)
+    if suffix is None:
+        suffix = _UTC_OFFSETS[offset_minutes] = datetime(2000, 1, 1, tzinfo=timezone(timedelta(minutes=offset_minutes))).isoformat()[19:]
+    return timestamp + suffix
+
+def encode_compact(payload):
+    """Encode a publisher payload dict compactly.
+
+    Returns None when the payload does not fit its schema (unknown type or
+    field, value out of range, sub-second timestamp); the caller then sends
+    it as JSON instead.
+    """
+    try:
+        schema_id, identity_key, fields = SCHEMAS[payload["type"]]
+        if set(payload) - {"trace"} != {identity_key, "timestamp", "type", "data"}:
+            return None
+        data = payload["data"]
+        if not set(data) <= {name for name, kind in fields}:
+            return None
+        trace = payload.get("trace")
+        if trace is not None and not set(trace) <= set(TRACE_KEYS):
+            return None
+
+        timestamp = datetime.fromisoformat(payload["timestamp"])
+        if timestamp.microsecond:
+            return None
+        flags = FLAG_TRACE if trace is not None else 0
+        if timestamp.tzinfo is not None:
+            flags |= FLAG_TZ_AWARE
+            offset = timestamp.utcoffset()
+        else:
+            offset = timestamp.astimezone().utcoffset()
+        offset_minutes = int(offset.total_seconds() // 60)
+
+        bitmap = 0
+        values = []
+        for index, (name, kind) in enumerate(fields):
+            if name in data:
+                bitmap |= 1 << index
+                values.append(_pack_value(kind, data[name]))
+        if trace is not None:
+            values.append(TRACE.pack(*(float(trace.get(key, math.nan)) for key in TRACE_KEYS)))
+
+        return (HEADER.pack(COMPACT_MAGIC, COMPACT_VERSION, schema_id, flags,
+                            int(timestamp.timestamp()), offset_minutes)
+                + _pack_string(payload[identity_key])
+                + BITMAP.pack(bitmap)
+                + b''.join(values))
+    except (KeyError, TypeError, ValueError, OverflowError, struct.error):
+        return None
+
+def decode_compact(buffer):
+    """Decode a compact payload back into the publisher's JSON payload dict, plus EPOCH_KEY."""
+    magic, version, schema_id, flags, seconds, offset_minutes = HEADER.unpack_from(buffer, 0)
+    if magic != COMPACT_MAGIC or version != COMPACT_VERSION:
+        raise ValueError(f"unsupported compact payload version {version}")
+    data_type, identity_key, fields = SCHEMAS_BY_ID[schema_id]
+
+    identity, offset = _unpack_string(buffer, HEADER.size)
+    bitmap, = BITMAP.unpack_from(buffer, offset)
+    offset += BITMAP.size
+    data = {}
+    for field_struct, names, floats in _decoder(schema_id, bitmap & ((1 << len(fields)) - 1)):
+        if field_struct is None:
+            data[names], offset = _unpack_string(buffer, offset)
+            continue
+        values = field_struct.unpack_from(buffer, offset)
+        offset += field_struct.size
+        if floats:
+            values = list(values)
+            for position in floats:
+                bits = values[position]
+                value = _FLOAT_VALUES.get(bits)
+                values[position] = value if value is not None else _float_value(bits)
+        data.update(zip(names, values))
+
+    payload = {
+        identity_key: identity,
+        "timestamp": _isoformat(seconds, offset_minutes, flags & FLAG_TZ_AWARE),
+        "type": data_type,
+        "data": data,
+        EPOCH_KEY: seconds
+    }
+    if flags & FLAG_TRACE:
+        times = TRACE.unpack_from(buffer, offset)
+        payload["trace"] = {key: value for key, value in zip(TRACE_KEYS, times) if not math.isnan(value)}
+    return payload
+
+def is_compact(buffer):
+    """Return True if a payload starts with the compact encoding magic byte."""
+    # JSON payloads start with '{' (or whitespace), never with 0xC5
+    return len(buffer) >= HEADER.size and buffer[0] == COMPACT_MAGIC
+
+def decode_payload(buffer):
+    """Decode a JSON or compact payload into a dict."""
+    if is_compact(buffer):
+        return decode_compact(buffer)
+    return json.loads(buffer.decode())
+
+def strip_compact_suffix(topic):
+    """Return (topic without the compact suffix, True if it had one)."""
+    if topic.endswith(COMPACT_TOPIC_SUFFIX):
+        return topic[:-len(COMPACT_TOPIC_SUFFIX)], True
+    return topic, False
@@ -35,6 +35,16 @@ python3 -c "import paho.mqtt.client" 2>/dev/null || {
     exit 1
 }
 
+# Start the publisher daemon, keeps one MQTT session open for all exports
+source <(grep mqtt_daemon_socket $path/user/export2mqtt.cfg)
+if [[ -n $mqtt_daemon_socket ]] ; then
+	if pgrep -f mqtt_publisher_daemon.py > /dev/null ; then
+		echo "$(timenow) MAIN * MQTT publisher daemon is running"
+	else echo "$(timenow) MAIN * Starting MQTT publisher daemon on $mqtt_daemon_socket"
+		nohup python3 -B $path/mqtt_publisher_daemon.py > ${switch_temp_path}/mqtt_daemon.log 2>&1 &
+	fi
+fi
+
 # Loop function
 loop_count=0
 while true ; do
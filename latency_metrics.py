@@ -0,0 +1,99 @@
+#!/usr/bin/python3
+
+import threading
+
+# Upper bounds of the histogram buckets in seconds, the last bucket is unbounded
+BUCKET_BOUNDS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5,
+                 1, 2, 5, 10, 30, 60, 300, 3600)
+
+METRICS_TOPIC = "healthdata/metrics"
+
+class LatencyHistogram:
+    """Fixed-bucket latency histogram that can be merged across processes."""
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKET_BOUNDS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        """Add one latency sample."""
+        seconds = max(seconds, 0.0)
+        index = 0
+        while index < len(BUCKET_BOUNDS) and seconds > BUCKET_BOUNDS[index]:
+            index += 1
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def merge(self, other):
+        """Add the samples of a histogram dict produced by to_dict()."""
+        for index, count in enumerate(other["buckets"][:len(self.counts)]):
+            self.counts[index] += count
+        self.count += other["count"]
+        self.sum += other["sum"]
+
+    def quantile(self, q):
+        """Return the upper bound of the bucket holding quantile q, None if empty."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return BUCKET_BOUNDS[index] if index < len(BUCKET_BOUNDS) else float('inf')
+        return float('inf')
+
+    def to_dict(self):
+        """Serializable form, merged on the receiving side with merge()."""
+        return {"buckets": list(self.counts), "count": self.count, "sum": self.sum}
+
+    def summary(self):
+        """Count, mean and p50/p90/p99 bucket bounds in milliseconds."""
+        def ms(value):
+            if value is None:
+                return None
+            return "inf" if value == float('inf') else round(value * 1000, 3)
+        return {
+            "count": self.count,
+            "mean_ms": ms(self.sum / self.count) if self.count else None,
+            "p50_ms": ms(self.quantile(0.5)),
+            "p90_ms": ms(self.quantile(0.9)),
+            "p99_ms": ms(self.quantile(0.99)),
+        }
+
+
+class LatencyRecorder:
+    """Thread-safe set of latency histograms keyed by pipeline stage."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+
+    def observe(self, stage, seconds):
+        """Add one latency sample for stage."""
+        with self._lock:
+            histogram = self._histograms.get(stage)
+            if histogram is None:
+                histogram = self._histograms[stage] = LatencyHistogram()
+            histogram.observe(seconds)
+
+    def merge(self, stages):
+        """Merge a {stage: histogram dict} mapping, e.g. from a metrics message."""
+        with self._lock:
+            for stage, histogram in stages.items():
+                if stage not in self._histograms:
+                    self._histograms[stage] = LatencyHistogram()
+                self._histograms[stage].merge(histogram)
+
+    def take(self):
+        """Return {stage: histogram dict} for the samples so far and start over."""
+        with self._lock:
+            histograms, self._histograms = self._histograms, {}
+        return {stage: histogram.to_dict() for stage, histogram in histograms.items()}
+
+    def summary(self):
+        """Return {stage: summary} for all stages."""
+        with self._lock:
+            return {stage: histogram.summary() for stage, histogram in self._histograms.items()}
@@ -3,12 +3,13 @@
 import os
 import csv
 import sys
+import time
 import Xiaomi_Scale_Body_Metrics
 from datetime import datetime as dt, date
 
 # Add parent directory to path to import mqtt_publisher
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from mqtt_publisher import MQTTHealthDataPublisher
+from mqtt_publisher_daemon import open_publisher, read_mqtt_config
 
 # Version info
 print("""
@@ -36,7 +37,7 @@ class User():
 # Importing user variables and MQTT config from a file
 path = os.path.dirname(os.path.dirname(__file__))
 users = []
-mqtt_config = {'host': 'localhost', 'port': 1883, 'username': None, 'password': None}
+mqtt_config = read_mqtt_config(path + '/user/export2mqtt.cfg')
 
 with open(path + '/user/export2mqtt.cfg', 'r') as file:
     for line in file:
@@ -44,16 +45,6 @@ with open(path + '/user/export2mqtt.cfg', 'r') as file:
         if line.startswith('miscale_export_'):
             user_data = eval(line.split('=')[1].strip())
             users.append(User(*user_data))
-        elif line.startswith('mqtt_host='):
-            mqtt_config['host'] = line.split('=')[1].strip()
-        elif line.startswith('mqtt_port='):
-            mqtt_config['port'] = int(line.split('=')[1].strip())
-        elif line.startswith('mqtt_username='):
-            username = line.split('=')[1].strip()
-            mqtt_config['username'] = username if username else None
-        elif line.startswith('mqtt_password='):
-            password = line.split('=')[1].strip()
-            mqtt_config['password'] = password if password else None
 
 # Import data variables from a file
 with open(path + '/user/miscale_backup.csv', 'r') as csv_file:
@@ -63,6 +54,7 @@ with open(path + '/user/miscale_backup.csv', 'r') as csv_file:
             mi_datetime = int(row[1])
             mi_weight = float(row[2])
             mi_impedance = float(row[3])
+            mi_read_at = time.time()
             break
 
 # Matching user account to weight
@@ -100,18 +92,11 @@ if selected_user is not None and 'email@email.com' not in selected_user.email:
     print(f"MISCALE * Import data: {mi_datetime};{mi_weight:.1f};{mi_impedance:.0f}")
     print(f"MISCALE * Calculated data: {formatted_time};{mi_weight:.1f};{body_data['bmi']:.1f};{body_data['body_fat_percent']:.1f};{body_data['muscle_mass']:.1f};{body_data['bone_mass']:.1f};{body_data['water_percent']:.1f};{body_data['physique_rating']:.0f};{body_data['visceral_fat']:.0f};{body_data['metabolic_age']:.0f};{body_data['bmr']:.0f};{body_data['lbm']:.1f};{body_data['ideal_weight']:.1f};{body_data['fat_mass_to_ideal']};{body_data['protein_percent']:.1f};{mi_impedance:.0f};{selected_user.email};{dt.now().strftime('%d.%m.%Y;%H:%M')}")
 
-    # Initialize MQTT publisher
-    mqtt_publisher = MQTTHealthDataPublisher(
-        broker_host=mqtt_config['host'],
-        broker_port=mqtt_config['port'],
-        username=mqtt_config['username'],
-        password=mqtt_config['password']
-    )
-
-    # Connect to MQTT broker
-    if mqtt_publisher.connect():
+    # Connect to MQTT broker, through the publisher daemon if it is running
+    mqtt_publisher = open_publisher(mqtt_config)
+    if mqtt_publisher is not None:
         # Publish data to MQTT
-        if mqtt_publisher.publish_body_composition(selected_user.email, mi_datetime, body_data):
+        if mqtt_publisher.publish_body_composition(selected_user.email, mi_datetime, body_data, read_at=mi_read_at):
             print("MISCALE * Upload status: OK")
         else:
             print("MISCALE * Upload status: FAILED")
@@ -0,0 +1,43 @@
+#!/usr/bin/python3
+
+import threading
+
+DEFAULT_CHANGE_LOG_SIZE = 10000  # changes kept for /changes without HISTORY_DB
+
+
+class ChangeLog:
+    """Append-only log of stored readings, numbered by a global sequence.
+
+    Sequence numbers start at 1 and have no gaps, so the change with
+    number seq is at a fixed slot of a ring buffer holding the newest
+    `capacity` changes: reading the changes after a cursor costs O(number
+    read), whatever the size of the log.
+    """
+
+    def __init__(self, capacity=DEFAULT_CHANGE_LOG_SIZE):
+        self.capacity = capacity
+        self._entries = [None] * capacity  # change seq at slot (seq - 1) % capacity
+        self._lock = threading.Lock()
+        self.last_seq = 0
+
+    def append(self, data_type, key, entry):
+        """Add a stored reading and return its sequence number."""
+        with self._lock:
+            seq = self.last_seq + 1
+            self._entries[(seq - 1) % self.capacity] = (seq, data_type, key, entry)
+            self.last_seq = seq
+            return seq
+
+    def since(self, seq, limit):
+        """Return up to limit (seq, type, key, entry) after seq, oldest first.
+
+        Returns None if seq is not a cursor of this log: changes after it
+        were already dropped, or it is ahead of the log (e.g. from before a
+        restart).
+        """
+        with self._lock:
+            first = max(1, self.last_seq - self.capacity + 1)
+            if seq < first - 1 or seq > self.last_seq:
+                return None
+            return [self._entries[(number - 1) % self.capacity]
+                    for number in range(seq + 1, min(seq + limit, self.last_seq) + 1)]
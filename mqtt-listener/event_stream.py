@@ -0,0 +1,79 @@
+#!/usr/bin/python3
+
+import json
+import queue
+import threading
+
+DEFAULT_QUEUE_SIZE = 100  # events buffered per subscriber before new ones are dropped
+
+
+class Subscriber:
+    """One /stream client: a bounded event queue and the users and types it wants."""
+
+    def __init__(self, users=None, types=None, queue_size=DEFAULT_QUEUE_SIZE):
+        self.users = frozenset(users) if users else None  # None = all
+        self.types = frozenset(types) if types else None
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.dropped = 0
+
+    def wants(self, data_type):
+        return self.types is None or data_type in self.types
+
+
+class EventBroadcaster:
+    """Fan stored readings out to Server-Sent Events subscribers.
+
+    publish() runs on the ingest path: it formats an event once and offers
+    it to the matching subscribers without blocking. A subscriber that does
+    not keep up loses events (counted in Subscriber.dropped) instead of
+    slowing down ingest. Subscribers are indexed by user, and the index is
+    replaced rather than changed, so publish() reads it without a lock.
+    """
+
+    def __init__(self, queue_size=DEFAULT_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+        self._by_user = {}  # {user: (subscriber, ...)}, for subscribers filtering on users
+        self._all_users = ()  # subscribers of all users
+
+    def __len__(self):
+        return len(self._all_users) + sum(len(subscribers) for subscribers in self._by_user.values())
+
+    def subscribe(self, users=None, types=None):
+        subscriber = Subscriber(users, types, self.queue_size)
+        with self._lock:
+            if subscriber.users is None:
+                self._all_users = self._all_users + (subscriber,)
+            else:
+                by_user = dict(self._by_user)
+                for user in subscriber.users:
+                    by_user[user] = by_user.get(user, ()) + (subscriber,)
+                self._by_user = by_user
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            if subscriber.users is None:
+                self._all_users = tuple(other for other in self._all_users if other is not subscriber)
+            else:
+                by_user = dict(self._by_user)
+                for user in subscriber.users:
+                    remaining = tuple(other for other in by_user.get(user, ()) if other is not subscriber)
+                    if remaining:
+                        by_user[user] = remaining
+                    else:
+                        by_user.pop(user, None)
+                self._by_user = by_user
+
+    def publish(self, data_type, key, entry):
+        """Offer a stored reading of a user (or device) to the subscribers that want it."""
+        subscribers = [subscriber for subscriber in self._all_users + self._by_user.get(key, ())
+                       if subscriber.wants(data_type)]
+        if not subscribers:
+            return
+        event = f"event: {data_type}\ndata: {json.dumps(dict(entry, user=key, type=data_type))}\n\n"
+        for subscriber in subscribers:
+            try:
+                subscriber.queue.put_nowait(event)
+            except queue.Full:
+                subscriber.dropped += 1
@@ -1,32 +1,112 @@
 #!/usr/bin/python3
 
-from flask import Flask, jsonify, request
+from flask import Flask, Response, g, jsonify, request, make_response, redirect
 from flask_cors import CORS
+import atexit
+import bisect
+import functools
+import queue
 import threading
 import json
 import time
+import uuid
 import os
-from datetime import datetime, timedelta
+import sys
+import zlib
+from datetime import datetime, timedelta, timezone
 import paho.mqtt.client as mqtt
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
 from typing import Dict, Optional, Any
 
+# Shared modules live in the project root (copied next to this file in the Docker image)
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import health_codec
+from latency_metrics import LatencyRecorder, METRICS_TOPIC
+from topic_router import TopicRouter
+from history_store import HistoryStore, DEFAULT_HISTORY_SIZE, to_epoch
+from sqlite_store import SQLiteStore
+from latest_store import LatestStore
+from event_stream import EventBroadcaster
+from ingest_pool import IngestPool, DEFAULT_WORKERS, DEFAULT_QUEUE_SIZE
+from readiness import Readiness
+from rollups import RollupStore, RESOLUTIONS, slope_per_day
+from prometheus_metrics import MetricsRegistry, serve as serve_metrics
+from change_log import ChangeLog, DEFAULT_CHANGE_LOG_SIZE
+from sharding import Shards, normalize_key, shared_subscription
+
 app = Flask(__name__)
 CORS(app)  # Enable CORS for web integrations
 
-# Storage for health data (in production, use a database)
-health_data_store = {
-    'body_composition': {},  # {user_email: latest_data}
-    'blood_pressure': {},    # {user_email: latest_data}
-    'temperature': {},       # {user_email: latest_data}
-    'pulse_oximetry': {},    # {user_email: latest_data}
-    'raw': {}               # {device_mac: latest_data}
-}
+USER_DATA_TYPES = ('body_composition', 'blood_pressure', 'temperature', 'pulse_oximetry')
+
+# Raw data is kept per device MAC, and in a shared clinic every visitor's
+# device that ever published would stay in memory. Keep the MAX_DEVICES
+# most recently seen devices and forget those silent for DEVICE_TTL seconds (0 = never).
+MAX_DEVICES = int(os.getenv('MAX_DEVICES', '1000'))
+DEVICE_TTL = int(os.getenv('DEVICE_TTL', str(7 * 24 * 3600)))
+
+# Latest reading per type and user (raw: per device MAC), with the summaries
+# behind /health and /users and the versions behind ETags. Ingest workers
+# write and Flask threads read it concurrently, see latest_store.py.
+store = LatestStore(USER_DATA_TYPES + ('raw',), USER_DATA_TYPES, limits={'raw': (MAX_DEVICES, DEVICE_TTL)})
+health_data_store = store.latest  # {data_type: {user_email or device_mac: latest_data}}
+
+# Versions count per process, so ETags carry an id unique to the process:
+# an ETag of an earlier process never matches. API processes (gunicorn
+# workers) use HISTORY_DB row ids as versions instead and share etag_id.
+BOOT_ID = uuid.uuid4().hex[:12]
+etag_id = BOOT_ID
+
+# Time-ordered readings per user and type, the newest HISTORY_SIZE of each
+HISTORY_SIZE = int(os.getenv('HISTORY_SIZE', str(DEFAULT_HISTORY_SIZE)))
+history = HistoryStore(HISTORY_SIZE)
+
+# Hourly, daily, weekly and monthly min/max/mean per user and type
+rollups = RollupStore()
+
+# Sequence-numbered log of stored readings behind /changes. With HISTORY_DB
+# the readings table is the log and its ids are the sequence numbers.
+CHANGE_LOG_SIZE = int(os.getenv('CHANGE_LOG_SIZE', str(DEFAULT_CHANGE_LOG_SIZE)))
+changes = ChangeLog(CHANGE_LOG_SIZE)
+
+# Warm start: /ready answers 503 until the retained backlog has been ingested
+readiness = Readiness()
+
+# Live readings for /stream clients
+events = EventBroadcaster()
+STREAM_KEEPALIVE = 15  # seconds between comments on an idle /stream, keeps proxies from closing it
+
+# Latency histograms per pipeline stage: the listener's own stages plus the
+# publisher stages merged from healthdata/metrics reports
+latency = LatencyRecorder()
+metrics_sources = {}  # {source: time of its last metrics report}
 
 # Configuration - Read from environment variables
 MQTT_HOST = os.getenv('MQTT_HOST', 'mosquitto')
 MQTT_PORT = int(os.getenv('MQTT_PORT', '1883'))
 MQTT_USERNAME = os.getenv('MQTT_USERNAME')
 MQTT_PASSWORD = os.getenv('MQTT_PASSWORD')
+MQTT_PROTOCOL = os.getenv('MQTT_PROTOCOL', '3.1.1')  # "3.1.1" or "5"
+HISTORY_DB = os.getenv('HISTORY_DB')  # SQLite file to persist readings in, e.g. /data/health_data.db
+INGEST_WORKERS = int(os.getenv('INGEST_WORKERS', str(DEFAULT_WORKERS)))  # 0 handles messages on the MQTT thread
+INGEST_QUEUE_SIZE = int(os.getenv('INGEST_QUEUE_SIZE', str(DEFAULT_QUEUE_SIZE)))  # per worker
+# "all" ingests and serves HTTP in one process. For several HTTP worker processes
+# run one "ingest" process and the workers as "api" (wsgi.py), sharing HISTORY_DB.
+LISTENER_ROLE = os.getenv('LISTENER_ROLE', 'all')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9101'))  # /metrics of the ingest process, which serves no API
+METRICS_DIR = os.getenv('METRICS_DIR')  # directory where gunicorn workers sum their counters for /metrics
+RETAINED_QUEUE_WAIT = 10  # seconds a retained message waits for room in the ingest queue, well within the keepalive
+FOLLOW_INTERVAL = 0.2  # seconds between HISTORY_DB polls of an idle api process
+MQTT_INGEST = os.getenv('MQTT_INGEST', 'on')  # "off" to start without the MQTT worker, e.g. in benchmark_ingest.py
+# Replicas: MQTT_SHARE_GROUP subscribes through a shared subscription, so the
+# broker splits the messages over the replicas. With SHARD_COUNT > 1 every
+# user belongs to one replica (SHARD_INDEX 0..SHARD_COUNT-1), which stores its
+# data; the others forward its messages and redirect its HTTP reads to SHARD_URLS.
+MQTT_SHARE_GROUP = os.getenv('MQTT_SHARE_GROUP')
+SHARD_COUNT = int(os.getenv('SHARD_COUNT', '1'))
+SHARD_INDEX = int(os.getenv('SHARD_INDEX', '0'))
+SHARD_URLS = [url for url in os.getenv('SHARD_URLS', '').split(',') if url]  # API base URL of each shard, in shard order
 
 # Log configuration on startup
 print(f"🔧 MQTT Configuration:")
@@ -34,97 +114,266 @@ print(f"   Host: {MQTT_HOST}")
 print(f"   Port: {MQTT_PORT}")
 print(f"   Username: {MQTT_USERNAME if MQTT_USERNAME else 'Anonymous'}")
 print(f"   Password: {'***' if MQTT_PASSWORD else 'None'}")
+print(f"   Protocol: MQTT {MQTT_PROTOCOL}")
+print(f"   History database: {HISTORY_DB if HISTORY_DB else 'None (memory only)'}")
+print(f"   Ingest workers: {INGEST_WORKERS}")
+print(f"   Devices kept: {MAX_DEVICES}, for {DEVICE_TTL}s" if DEVICE_TTL else f"   Devices kept: {MAX_DEVICES}")
+print(f"   Role: {LISTENER_ROLE}")
+if MQTT_SHARE_GROUP:
+    print(f"   Shared subscription group: {MQTT_SHARE_GROUP}")
+if SHARD_COUNT > 1:
+    print(f"   Shard: {SHARD_INDEX} of 0..{SHARD_COUNT - 1}")
 
-def on_connect(client, userdata, flags, rc):
+try:
+    shards = Shards(SHARD_COUNT, SHARD_INDEX, SHARD_URLS)
+except ValueError as e:
+    raise SystemExit(f"Invalid shard configuration: {e}")
+
+# Topic patterns of mqtt_publisher.py (health/...) and the Android app (healthdata/...)
+router = TopicRouter()
+
+def on_connect(client, userdata, flags, rc, properties=None):
     if rc == 0:
         print("✓ Connected to MQTT broker")
+        mqtt_connects.inc()
         # Subscribe to all health topics
-        client.subscribe("healthdata/+/+")
-        client.subscribe("healthdata/devices/+")
-        print("✓ Subscribed to health topics")
+        for topic_filter in router.subscriptions():
+            if topic_filter == METRICS_TOPIC:
+                client.subscribe(topic_filter)  # every replica merges the latency reports
+                continue
+            # Compact encoded payloads (health_codec.py) use the same topics plus a suffix
+            for measurement_filter in (topic_filter, topic_filter + health_codec.COMPACT_TOPIC_SUFFIX):
+                client.subscribe(shared_subscription(measurement_filter, MQTT_SHARE_GROUP) if MQTT_SHARE_GROUP else measurement_filter)
+        if shards.enabled and MQTT_SHARE_GROUP:
+            client.subscribe(shards.inbox())
+        print("✓ Subscribed to health topics" + (f" in group {MQTT_SHARE_GROUP}" if MQTT_SHARE_GROUP else ""))
+        readiness.subscribed()
     else:
         print(f"✗ Failed to connect to MQTT broker, code: {rc}")
 
-def on_message(client, userdata, msg):
+def on_disconnect(client, userdata, rc, properties=None):
+    if rc != 0:
+        print(f"✗ Disconnected from MQTT broker, code: {rc}, reconnecting")
+    mqtt_disconnects.inc()
+
+def record_latency(data, received_at):
+    """Record delivery, store and end-to-end latency of a traced payload."""
+    trace = data.get('trace')
+    if not isinstance(trace, dict):
+        return
+    visible_at = time.time()
+    if 'sent' in trace:
+        latency.observe('delivery', received_at - trace['sent'])
+    latency.observe('store', visible_at - received_at)
+    if 'read' in trace:
+        latency.observe('end_to_end', visible_at - trace['read'])
+
+def on_metrics(key, report):
+    """Merge a latency report published by MQTTHealthDataPublisher."""
+    source = report.get('source', 'unknown')
+    latency.merge(report.get('stages', {}))
+    metrics_sources[source] = datetime.now().isoformat()
+    summary = latency.summary()
+    print(f"⏱️ Latency metrics from {source}: " + ", ".join(
+        f"{stage} p50={stats['p50_ms']}ms p99={stats['p99_ms']}ms" for stage, stats in summary.items()))
+
+def on_discovery(key, data):
+    """Log a device found by the Android app's BLE scan."""
+    print(f"📱 Device discovered: {data.get('device_name')} ({data.get('device_mac')}) RSSI: {data.get('rssi')}dBm")
+
+# Log line per stored measurement type
+MEASUREMENT_LOGS = {
+    'body_composition': lambda key, data: f"📊 Body composition data for {key}: BMI={data.get('bmi')}, Weight={data.get('weight')}kg",
+    'blood_pressure': lambda key, data: f"🩺 Blood pressure data for {key}: {data.get('systolic')}/{data.get('diastolic')} mmHg",
+    'temperature': lambda key, data: f"🌡️ Temperature data for {key}: {data.get('temperature_celsius')}°C",
+    'pulse_oximetry': lambda key, data: f"🫁 Pulse oximetry data for {key}: SpO2={data.get('spo2_percentage')}%, HR={data.get('pulse_rate')} BPM",
+    'raw': lambda key, data: f"📱 Raw device data from {key}: {data.get('weight')}kg, {data.get('impedance')}Ω",
+}
+
+def apply_reading(data_type, key, t, entry, version=None):
+    """Make a reading taken at Unix time t visible to the API: latest value, history and /stream.
+
+    version is its HISTORY_DB row id in API processes. Returns False for a
+    reading of a user that is already in the history.
+    """
+    if data_type in USER_DATA_TYPES:
+        if not history.add(data_type, key, t, entry):
+            return False  # resent, e.g. replayed from a publisher's outbox
+        rollups.add(data_type, key, t, entry['data'])
+    store.set(data_type, key, entry, t, version)
+    events.publish(data_type, key, entry)
+    return True
+
+def store_measurement(data_type, key, timestamp, data, t=None):
+    """Store the latest measurement of a user (or device), add it to the history and log it.
+
+    t is the reading time as Unix seconds when the decoder already knows it,
+    otherwise it is parsed from timestamp.
+    """
+    latest = store.get(data_type, key)
+    if latest is not None and timestamp is not None and latest['timestamp'] == timestamp and latest['data'] == data:
+        return  # the same reading again, e.g. retained on the broker and restored from HISTORY_DB
+    received_at = datetime.now()
+    entry = {
+        'timestamp': timestamp,
+        'received_at': received_at.isoformat(),
+        'data': data
+    }
+    if t is None:
+        t = to_epoch(timestamp)
+    if t is None:
+        t = received_at.timestamp()
+    if not apply_reading(data_type, key, t, entry):
+        return
+    if database is not None:
+        database.put(data_type, key, t, entry)
+    else:
+        changes.append(data_type, key, entry)
+    # The retained backlog after (re)starting is summarized by readiness instead
+    if not readiness.warming:
+        print(MEASUREMENT_LOGS[data_type](key, data))
+
+def health_handler(data_type):
+    """Handler for mqtt_publisher.py payloads: {"user"/"device", "timestamp", "type", "data", "trace"}."""
+    def handle(key, payload):
+        # The payload has the exact email, the topic only its sanitized form
+        store_measurement(data_type, payload.get('user', key), payload.get('timestamp'), payload.get('data', {}),
+                          payload.get(health_codec.EPOCH_KEY))
+    return handle
+
+def healthdata_handler(data_type):
+    """Handler for Android app payloads, the measurement fields at the top level."""
+    def handle(key, data):
+        store_measurement(data_type, key, data.get('timestamp'), data)
+    return handle
+
+# Message handlers by (topic layout, measurement type), see topic_router.TOPIC_ROUTES
+MESSAGE_HANDLERS = {
+    ('health', 'body_composition'): health_handler('body_composition'),
+    ('health', 'blood_pressure'): health_handler('blood_pressure'),
+    ('health', 'raw_scale_data'): health_handler('raw'),
+    ('healthdata', 'body_composition'): healthdata_handler('body_composition'),
+    ('healthdata', 'blood_pressure'): healthdata_handler('blood_pressure'),
+    ('healthdata', 'temperature'): healthdata_handler('temperature'),
+    ('healthdata', 'pulse_oximetry'): healthdata_handler('pulse_oximetry'),
+    ('healthdata', 'raw_scale_data'): healthdata_handler('raw'),
+    ('healthdata', 'discovery'): on_discovery,
+    ('healthdata', 'metrics'): on_metrics,
+}
+
+def on_message(client, userdata, msg, received_at=None):
+    if received_at is None:
+        received_at = time.time()
+    else:
+        ingest_lag.observe(time.time() - received_at)
     try:
-        topic_parts = msg.topic.split('/')
+        topic, compact = health_codec.strip_compact_suffix(shards.unwrap(msg.topic))
+        route = router.route(topic)
+        handler = MESSAGE_HANDLERS.get((route.schema, route.data_type)) if route else None
+        if handler is None:
+            messages_ignored.inc()
+            return
         
-        if len(topic_parts) >= 3 and topic_parts[0] == 'healthdata':
-            data = json.loads(msg.payload.decode())
-            
-            # Handle user-specific health data
-            if len(topic_parts) == 3 and topic_parts[1] != 'devices':
-                user_email = topic_parts[1].replace('_at_', '@').replace('_', '.')
-                data_type = topic_parts[2]
-                
-                if data_type == 'body_composition':
-                    health_data_store['body_composition'][user_email] = {
-                        'timestamp': data.get('timestamp'),
-                        'received_at': datetime.now().isoformat(),
-                        'data': data
-                    }
-                    print(f"📊 Body composition data for {user_email}: BMI={data.get('bmi')}, Weight={data.get('weight')}kg")
-                    
-                elif data_type == 'blood_pressure':
-                    health_data_store['blood_pressure'][user_email] = {
-                        'timestamp': data.get('timestamp'),
-                        'received_at': datetime.now().isoformat(),
-                        'data': data
-                    }
-                    print(f"🩺 Blood pressure data for {user_email}: {data.get('systolic')}/{data.get('diastolic')} mmHg")
-                    
-                elif data_type == 'temperature':
-                    health_data_store['temperature'][user_email] = {
-                        'timestamp': data.get('timestamp'),
-                        'received_at': datetime.now().isoformat(),
-                        'data': data
-                    }
-                    print(f"🌡️ Temperature data for {user_email}: {data.get('temperature_celsius')}°C")
-                    
-                elif data_type == 'pulse_oximetry':
-                    health_data_store['pulse_oximetry'][user_email] = {
-                        'timestamp': data.get('timestamp'),
-                        'received_at': datetime.now().isoformat(),
-                        'data': data
-                    }
-                    print(f"🫁 Pulse oximetry data for {user_email}: SpO2={data.get('spo2_percentage')}%, HR={data.get('pulse_rate')} BPM")
-                    
-            # Handle device-specific data
-            elif topic_parts[1] == 'devices':
-                if topic_parts[2] == 'discovery':
-                    device_mac = data.get('device_mac')
-                    device_name = data.get('device_name')
-                    rssi = data.get('rssi')
-                    print(f"📱 Device discovered: {device_name} ({device_mac}) RSSI: {rssi}dBm")
-                    
-                elif len(topic_parts) == 4:  # healthdata/devices/{mac}/raw_scale_data
-                    device_mac = topic_parts[2]
-                    health_data_store['raw'][device_mac] = {
-                        'timestamp': data.get('timestamp'),
-                        'received_at': datetime.now().isoformat(),
-                        'data': data
-                    }
-                    print(f"📱 Raw device data from {device_mac}: {data.get('weight')}kg, {data.get('impedance')}Ω")
+        # MQTT v5 publishers announce the encoding and payload schema as properties
+        properties = getattr(msg, 'properties', None)
+        if getattr(properties, 'ContentType', None) == health_codec.CONTENT_TYPE_COMPACT:
+            compact = True
+        schema = dict(getattr(properties, 'UserProperty', [])).get('schema')
+        if schema is not None:
+            try:
+                if int(schema) > health_codec.PAYLOAD_SCHEMA_VERSION:
+                    print(f"⚠️ Payload schema {schema} on {msg.topic} is newer than supported ({health_codec.PAYLOAD_SCHEMA_VERSION})")
+            except ValueError:
+                # Unknown schema, do not trust the properties and tell the encoding from the payload
+                print(f"⚠️ Invalid payload schema {schema!r} on {msg.topic}")
+                compact = False
+        
+        decode_started = time.perf_counter()
+        try:
+            data = health_codec.decode_compact(msg.payload) if compact else health_codec.decode_payload(msg.payload)
+        except Exception as e:
+            message_errors.inc('decode')
+            print(f"Error decoding message from {msg.topic}: {e}")
+            return
+        handle_started = time.perf_counter()
+        decode_seconds.observe(handle_started - decode_started, 'compact' if compact else 'json')
+        handler(route.key, data)
+        handler_seconds.observe(time.perf_counter() - handle_started, route.data_type)
+        messages_total.inc(route.schema, route.data_type)
+        record_latency(data, received_at)
                 
     except Exception as e:
+        message_errors.inc('handler')
         print(f"Error processing message from {msg.topic}: {e}")
 
+def forward_properties(msg):
+    """MQTT v5 properties of a message that its handling depends on, to forward them with it."""
+    properties = getattr(msg, 'properties', None)
+    if properties is None or MQTT_PROTOCOL != '5':
+        return None
+    forwarded = Properties(PacketTypes.PUBLISH)
+    for name in ('ContentType', 'UserProperty'):
+        if hasattr(properties, name):
+            setattr(forwarded, name, getattr(properties, name))
+    return forwarded
+
+def owned_by_this_shard(client, msg, key):
+    """Return True if this replica stores the message of user (or device) key; forward messages of other shards' users."""
+    if msg.topic.startswith(shards.inbox()[:-1]):
+        return True  # forwarded to this shard
+    if key is None or shards.owns(key):
+        return True
+    # Without a shared subscription every replica receives the message itself
+    if MQTT_SHARE_GROUP:
+        client.publish(shards.forward_topic(shards.owner(key), msg.topic), msg.payload, msg.qos,
+                       properties=forward_properties(msg))
+        messages_forwarded.inc()
+    return False
+
+def receive_message(client, userdata, msg):
+    """paho on_message: note retained messages for the warm start and hand the message on."""
+    route = router.route(health_codec.strip_compact_suffix(shards.unwrap(msg.topic))[0])
+    key = route.key if route is not None else None
+    if shards.enabled and not owned_by_this_shard(client, msg, key):
+        if msg.retain:
+            readiness.retained_received()  # forwarded to its shard
+        return
+    if ingest is not None:
+        # One worker per user (or device), whatever topic form its messages arrive on,
+        # so its readings are handled in order. The retained burst after subscribing
+        # can exceed the queue: wait for room, the broker holds back the rest meanwhile.
+        queued = ingest.submit(client, userdata, msg, normalize_key(key) if key is not None else None,
+                               RETAINED_QUEUE_WAIT if msg.retain else None)
+        if msg.retain:
+            readiness.retained_received(queued)
+    else:
+        if msg.retain:
+            readiness.retained_received()
+        on_message(client, userdata, msg)
+
+def watch_warmup():
+    """End the warm start once the retained backlog has been handled."""
+    while not readiness.check(ingest.depth() if ingest is not None else 0):
+        time.sleep(0.2)
+
 def mqtt_worker():
     """Background thread to handle MQTT connection"""
-    global MQTT_HOST, MQTT_PORT, MQTT_USERNAME, MQTT_PASSWORD
+    global MQTT_HOST, MQTT_PORT, MQTT_USERNAME, MQTT_PASSWORD, MQTT_PROTOCOL
     
     try:
+        protocol = mqtt.MQTTv5 if MQTT_PROTOCOL == '5' else mqtt.MQTTv311
         # Use callback API version for newer paho-mqtt
         try:
-            client = mqtt.Client(callback_api_version=mqtt.CallbackAPIVersion.VERSION1)
+            client = mqtt.Client(callback_api_version=mqtt.CallbackAPIVersion.VERSION1, protocol=protocol)
         except AttributeError:
-            client = mqtt.Client()
+            client = mqtt.Client(protocol=protocol)
             
         if MQTT_USERNAME and MQTT_PASSWORD:
             client.username_pw_set(MQTT_USERNAME, MQTT_PASSWORD)
             
         client.on_connect = on_connect
-        client.on_message = on_message
+        client.on_disconnect = on_disconnect
+        client.on_message = receive_message
         
         client.connect(MQTT_HOST, MQTT_PORT, 60)
         client.loop_forever()
@@ -132,11 +381,168 @@ def mqtt_worker():
     except Exception as e:
         print(f"MQTT worker error: {e}")
 
-# Start MQTT client in background
-threading.Thread(target=mqtt_worker, daemon=True).start()
+def restore_history(up_to_id=None):
+    """Reload the latest readings and the history from the SQLite database."""
+    count = 0
+    for row_id, data_type, key, t, entry in database.load(HISTORY_SIZE, up_to_id):
+        # Oldest first, so the last reading of a user and type ends up as the latest
+        store.set(data_type, key, entry, t, row_id if LISTENER_ROLE == 'api' else None)
+        if data_type in USER_DATA_TYPES:
+            history.add(data_type, key, t, entry)
+            rollups.add(data_type, key, t, entry['data'])
+        count += 1
+    print(f"💾 Restored {count} readings from {HISTORY_DB}")
+
+def follow_database(last_id):
+    """Apply the readings the ingest process writes to HISTORY_DB after last_id (LISTENER_ROLE=api)."""
+    while True:
+        try:
+            rows = database.follow(last_id)
+        except Exception as e:
+            print(f"Error reading {HISTORY_DB}: {e}")
+            rows = []
+        for row_id, data_type, key, t, entry in rows:
+            apply_reading(data_type, key, t, entry, row_id)
+            last_id = row_id
+        if len(rows) < database.batch_size:
+            readiness.mark_ready()  # caught up with the ingest process
+            time.sleep(FOLLOW_INTERVAL)
+
+if LISTENER_ROLE not in ('all', 'ingest', 'api'):
+    raise SystemExit(f"Unknown LISTENER_ROLE {LISTENER_ROLE}, expected all, ingest or api")
+if LISTENER_ROLE != 'all' and not HISTORY_DB:
+    raise SystemExit(f"LISTENER_ROLE={LISTENER_ROLE} needs HISTORY_DB, the ingest and API processes share it")
+
+# Prometheus metrics for /metrics, defined before the threads below update
+# them. Counters and histograms are updated on the ingest and request paths;
+# gauges are read when /metrics is scraped.
+metrics = MetricsRegistry()
+if METRICS_DIR:
+    metrics.share(METRICS_DIR)
+messages_total = metrics.counter('healthdata_messages_total', 'MQTT messages stored or handled, by topic layout and type', ('layout', 'type'))
+messages_ignored = metrics.counter('healthdata_messages_ignored_total', 'MQTT messages on topics without a handler')
+message_errors = metrics.counter('healthdata_message_errors_total', 'MQTT messages that failed, by stage (decode or handler)', ('stage',))
+decode_seconds = metrics.histogram('healthdata_decode_seconds', 'Payload decode time', ('encoding',))
+handler_seconds = metrics.histogram('healthdata_handler_seconds', 'Message handler time after decoding', ('type',))
+ingest_lag = metrics.histogram('healthdata_ingest_queue_lag_seconds', 'Time messages waited in the ingest queue')
+mqtt_connects = metrics.counter('healthdata_mqtt_connects_total', 'Successful MQTT (re)connects')
+mqtt_disconnects = metrics.counter('healthdata_mqtt_disconnects_total', 'MQTT disconnects')
+messages_forwarded = metrics.counter('healthdata_messages_forwarded_total', 'MQTT messages republished to the shard of their user')
+http_seconds = metrics.histogram('healthdata_http_request_seconds', 'HTTP handler time by route and status', ('route', 'status'))
+metrics.gauge('healthdata_store_entries', 'Users (devices for raw) with a latest reading, by type',
+              lambda: {(data_type,): len(latest) for data_type, latest in store.latest.items()}, ('type',))
+metrics.gauge('healthdata_users', 'Users with any reading', lambda: len(store.user_order))
+metrics.gauge('healthdata_devices_evicted_total', 'Devices dropped for MAX_DEVICES or DEVICE_TTL',
+              lambda: store.evicted, kind='counter')
+metrics.gauge('healthdata_ingest_queue_depth', 'Messages waiting for an ingest worker', lambda: ingest.depth() if ingest is not None else 0)
+metrics.gauge('healthdata_ingest_dropped_total', 'Messages dropped because the ingest queue was full',
+              lambda: ingest.dropped if ingest is not None else 0, kind='counter')
+metrics.gauge('healthdata_stream_subscribers', 'Connected /stream clients', lambda: len(events))
+metrics.gauge('healthdata_database_written_total', 'Readings written to HISTORY_DB',
+              lambda: database.written if database is not None else 0, kind='counter')
+metrics.gauge('healthdata_ready', '1 once the warm start is done', lambda: int(not readiness.warming))
+
+# Persist readings to SQLite, restoring what was stored before a restart.
+# API processes only read it and follow what the ingest process writes.
+database = None
+if HISTORY_DB:
+    database = SQLiteStore(HISTORY_DB)
+    if LISTENER_ROLE == 'api':
+        # Every worker versions readings by row id, so an ETag from one worker matches on all
+        etag_id = f"db{os.stat(HISTORY_DB).st_ino:x}"
+        last_id = database.last_id()
+        restore_history(last_id)
+        threading.Thread(target=follow_database, args=(last_id,), daemon=True).start()
+    else:
+        restore_history()
+        database.start()
+        atexit.register(database.close)
+
+# Start MQTT client in background, messages are handled on the ingest
+# workers and paho's network thread only queues them
+ingest = None
+mqtt_thread = None
+if MQTT_INGEST != 'off' and LISTENER_ROLE != 'api':
+    if INGEST_WORKERS > 0:
+        ingest = IngestPool(on_message, INGEST_WORKERS, INGEST_QUEUE_SIZE, latency).start()
+    mqtt_thread = threading.Thread(target=mqtt_worker, daemon=True)
+    mqtt_thread.start()
+    threading.Thread(target=watch_warmup, daemon=True).start()
+elif LISTENER_ROLE != 'api':
+    readiness.mark_ready()  # nothing to warm up from
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def observe_request(response):
+    # /stream responses are timed until the stream starts, not for its lifetime
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    http_seconds.observe(time.perf_counter() - g.request_started, route, str(response.status_code))
+    return response
+
+@app.before_request
+def route_to_shard():
+    """Send reads of a user (or device) of another shard to that shard."""
+    if not shards.enabled or not request.view_args:
+        return None
+    key = request.view_args.get('email') or request.view_args.get('device_mac')
+    if key is None or shards.owns(key):
+        return None
+    owner = shards.owner(key)
+    if not shards.urls:
+        # 421 Misdirected Request: the client or proxy has to pick the shard
+        return jsonify({"error": f"{key} is served by shard {owner}", "shard": owner}), 421
+    return redirect(shards.urls[owner] + request.full_path.rstrip('?'), 307)
+
+def group_by_shard(keys):
+    """Return {shard: [keys]} of the keys (emails or MACs) of other shards."""
+    groups = {}
+    if shards.enabled:
+        for key in keys:
+            owner = shards.owner(key)
+            if owner != shards.index:
+                groups.setdefault(owner, []).append(key)
+    return groups
 
 # API Routes
 
+def conditional(types=None, key='email'):
+    """Support conditional GET (If-None-Match / If-Modified-Since) on a view of the latest readings.
+
+    The ETag and Last-Modified come from the store versions of the view's user
+    (or device, URL argument key) and types, default the data_type URL
+    argument. A client whose copy is current gets 304 without the view
+    touching the store.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(**kwargs):
+            # Expired entries (raw data past DEVICE_TTL) keep their version until evicted
+            versions = [store.versions.get((data_type, kwargs[key])) for data_type in (types or (kwargs['data_type'],))
+                        if store.get(data_type, kwargs[key]) is not None]
+            versions = [version for version in versions if version is not None]
+            if not versions:
+                return view(**kwargs)
+            etag = f"{etag_id}-{max(version for version, modified in versions)}"
+            last_modified = datetime.fromtimestamp(int(max(modified for version, modified in versions)), timezone.utc)
+            
+            if request.if_none_match:
+                current = request.if_none_match.contains(etag)
+            else:
+                current = request.if_modified_since is not None and last_modified <= request.if_modified_since
+            if current:
+                response = app.response_class(status=304)
+            else:
+                response = make_response(view(**kwargs))
+            response.set_etag(etag)
+            response.last_modified = last_modified
+            return response
+        return wrapper
+    return decorator
+
+
 @app.route("/")
 def index():
     """API documentation"""
@@ -146,146 +552,459 @@ def index():
         "description": "REST API for accessing health data from MQTT",
         "endpoints": {
             "/health": "Get health status",
+            "/ready": "503 until the retained backlog is loaded after a start",
             "/users": "List all users with data",
             "/user/<email>/latest": "Get latest data for user",
+            "/users/latest": "Latest data for many users (?emails= or ?cursor=&limit=, &types=)",
             "/user/<email>/body_composition": "Get body composition data",
             "/user/<email>/blood_pressure": "Get blood pressure data",
             "/user/<email>/temperature": "Get temperature data",
             "/user/<email>/pulse_oximetry": "Get pulse oximetry data",
+            "/user/<email>/<type>/history": "Readings of a type over time (?from=&to=&limit=)",
+            "/user/<email>/<type>/rollup": "Min/max/mean per hour, day, week or month (?res=&from=&to=&fields=)",
             "/weight/<email>": "Get just weight (OpenEMR compatible)",
-            "/devices": "List raw device data"
+            "/devices": "List raw device data (?cursor=&limit=)",
+            "/stream": "Live readings as Server-Sent Events (?user=&type=)",
+            "/latency": "Per-stage publish latency (p50/p90/p99)",
+            "/metrics": "Prometheus metrics of the ingest path and API",
+            "/export": "All readings as NDJSON, gzip if accepted (?since=&types=)",
+            "/changes": "Readings stored after a sequence number (?since=&limit=)"
         }
     })
 
 @app.route("/health")
 def health_check():
     """Health check endpoint"""
-    data_count = (
-        len(health_data_store['body_composition']) +
-        len(health_data_store['blood_pressure']) +
-        len(health_data_store['temperature']) +
-        len(health_data_store['pulse_oximetry']) +
-        len(health_data_store['raw'])
-    )
-    
     return jsonify({
         "status": "healthy",
         "timestamp": datetime.now().isoformat(),
-        "data_points": data_count,
-        "users": list(set(
-            list(health_data_store['body_composition'].keys()) +
-            list(health_data_store['blood_pressure'].keys()) +
-            list(health_data_store['temperature'].keys()) +
-            list(health_data_store['pulse_oximetry'].keys())
-        ))
+        "data_points": store.data_points,
+        "users": list(store.summaries_snapshot()),
+        "shard": {"index": shards.index, "count": shards.count}
     })
 
+@app.route("/ready")
+def ready_check():
+    """Readiness endpoint for load balancers"""
+    ready = readiness.check(ingest.depth() if ingest is not None else 0)
+    return jsonify(readiness.status()), 200 if ready else 503
+
 @app.route("/users")
 def list_users():
     """List all users with available data"""
-    users = {}
+    return jsonify(store.summaries_snapshot())
+
+USERS_LATEST_PAGE = 100
+USERS_LATEST_MAX_PAGE = 1000
+
+def shard_users(shard, emails):
+    """Describe where to ask for the emails of another shard."""
+    result = {"emails": emails}
+    if shards.urls:
+        result["url"] = shards.urls[shard] + request.path
+    return result
+
+@app.route("/users/latest", methods=['GET', 'POST'])
+def get_users_latest():
+    """Latest data of many users in one streamed response.
     
-    for email in health_data_store['body_composition']:
-        users[email] = users.get(email, {})
-        users[email]['body_composition'] = health_data_store['body_composition'][email]['received_at']
+    Users are given as ?emails= (comma separated, or a JSON body
+    {"emails": [...], "types": [...]} for long lists), or paged through with
+    ?cursor=&limit=; next_cursor is null on the last page. ?types= limits
+    the measurement types. With shards, requested users of other shards
+    are listed under other_shards by shard, to ask there.
+    """
+    body = (request.get_json(silent=True) or {}) if request.method == 'POST' else {}
+    types = body.get('types') or [data_type for data_type in request.args.get('types', '').split(',') if data_type]
+    unknown = set(types) - set(USER_DATA_TYPES)
+    if unknown:
+        return jsonify({"error": f"Unknown data type: {', '.join(sorted(unknown))}"}), 400
+    types = types or USER_DATA_TYPES
     
-    for email in health_data_store['blood_pressure']:
-        users[email] = users.get(email, {})
-        users[email]['blood_pressure'] = health_data_store['blood_pressure'][email]['received_at']
-        
-    for email in health_data_store['temperature']:
-        users[email] = users.get(email, {})
-        users[email]['temperature'] = health_data_store['temperature'][email]['received_at']
-        
-    for email in health_data_store['pulse_oximetry']:
-        users[email] = users.get(email, {})
-        users[email]['pulse_oximetry'] = health_data_store['pulse_oximetry'][email]['received_at']
+    emails = body.get('emails') or [email for email in request.args.get('emails', '').split(',') if email]
+    next_cursor = None
+    if not emails:
+        try:
+            cursor = int(request.args.get('cursor', 0))
+            limit = min(int(request.args.get('limit', USERS_LATEST_PAGE)), USERS_LATEST_MAX_PAGE)
+        except ValueError:
+            return jsonify({"error": "cursor and limit must be integers"}), 400
+        if cursor < 0 or limit < 1:
+            return jsonify({"error": "cursor must be >= 0 and limit >= 1"}), 400
+        emails = store.user_order[cursor:cursor + limit]
+        if cursor + limit < len(store.user_order):
+            next_cursor = cursor + limit
     
-    return jsonify(users)
+    other_shards = group_by_shard(emails)
+    if other_shards:
+        elsewhere = {email for users in other_shards.values() for email in users}
+        emails = [email for email in emails if email not in elsewhere]
+    other_shards = {str(shard): shard_users(shard, users) for shard, users in other_shards.items()}
+    
+    def generate():
+        missing = []
+        separator = ''
+        yield '{"users": {'
+        for email in emails:
+            result = {}
+            for data_type in types:
+                entry = store.get(data_type, email)
+                if entry is not None:
+                    result[data_type] = entry
+            if result:
+                yield f"{separator}{json.dumps(email)}: {json.dumps(result)}"
+                separator = ', '
+            else:
+                missing.append(email)
+        yield f'}}, "missing": {json.dumps(missing)}, "next_cursor": {json.dumps(next_cursor)}'
+        if shards.enabled:
+            yield f', "other_shards": {json.dumps(other_shards)}'
+        yield '}'
+    
+    return Response(generate(), mimetype='application/json')
 
 @app.route("/user/<email>/latest")
+@conditional(USER_DATA_TYPES)
 def get_user_latest(email):
     """Get all latest data for a user"""
     result = {"user": email}
     
-    if email in health_data_store['body_composition']:
-        result['body_composition'] = health_data_store['body_composition'][email]
+    for data_type in USER_DATA_TYPES:
+        entry = store.get(data_type, email)
+        if entry is not None:
+            result[data_type] = entry
     
-    if email in health_data_store['blood_pressure']:
-        result['blood_pressure'] = health_data_store['blood_pressure'][email]
-        
-    if email in health_data_store['temperature']:
-        result['temperature'] = health_data_store['temperature'][email]
-        
-    if email in health_data_store['pulse_oximetry']:
-        result['pulse_oximetry'] = health_data_store['pulse_oximetry'][email]
-    
-    if not any([result.get('body_composition'), result.get('blood_pressure'), 
-               result.get('temperature'), result.get('pulse_oximetry')]):
+    if len(result) == 1:
         return jsonify({"error": "No data found for user"}), 404
     
     return jsonify(result)
 
 @app.route("/user/<email>/body_composition")
+@conditional(('body_composition',))
 def get_body_composition(email):
     """Get body composition data for user"""
-    if email not in health_data_store['body_composition']:
+    entry = store.get('body_composition', email)
+    if entry is None:
         return jsonify({"error": "No body composition data found"}), 404
     
-    return jsonify(health_data_store['body_composition'][email])
+    return jsonify(entry)
 
 @app.route("/user/<email>/blood_pressure")
+@conditional(('blood_pressure',))
 def get_blood_pressure(email):
     """Get blood pressure data for user"""
-    if email not in health_data_store['blood_pressure']:
+    entry = store.get('blood_pressure', email)
+    if entry is None:
         return jsonify({"error": "No blood pressure data found"}), 404
     
-    return jsonify(health_data_store['blood_pressure'][email])
+    return jsonify(entry)
 
 @app.route("/user/<email>/temperature")
+@conditional(('temperature',))
 def get_temperature(email):
     """Get temperature data for user"""
-    if email not in health_data_store['temperature']:
+    entry = store.get('temperature', email)
+    if entry is None:
         return jsonify({"error": "No temperature data found"}), 404
     
-    return jsonify(health_data_store['temperature'][email])
+    return jsonify(entry)
 
 @app.route("/user/<email>/pulse_oximetry")
+@conditional(('pulse_oximetry',))
 def get_pulse_oximetry(email):
     """Get pulse oximetry data for user"""
-    if email not in health_data_store['pulse_oximetry']:
+    entry = store.get('pulse_oximetry', email)
+    if entry is None:
         return jsonify({"error": "No pulse oximetry data found"}), 404
     
-    return jsonify(health_data_store['pulse_oximetry'][email])
+    return jsonify(entry)
+
+@app.route("/user/<email>/<data_type>/history")
+@conditional()
+def get_history(email, data_type):
+    """Get the readings of a type for user, optionally limited to ?from=&to= (ISO 8601 or Unix time) and the newest ?limit="""
+    if data_type not in USER_DATA_TYPES:
+        return jsonify({"error": f"Unknown data type: {data_type}"}), 404
+    if not history.has(data_type, email):
+        return jsonify({"error": f"No {data_type.replace('_', ' ')} history found"}), 404
+    
+    args = request.args
+    start = to_epoch(args['from']) if 'from' in args else None
+    end = to_epoch(args['to']) if 'to' in args else None
+    if ('from' in args and start is None) or ('to' in args and end is None):
+        return jsonify({"error": "from and to must be ISO 8601 timestamps or Unix times"}), 400
+    try:
+        limit = int(args['limit']) if 'limit' in args else None
+    except ValueError:
+        limit = -1
+    if limit is not None and limit < 0:
+        return jsonify({"error": "limit must be a non-negative integer"}), 400
+    
+    readings = history.query(data_type, email, start, end, limit)
+    return jsonify({
+        "user": email,
+        "type": data_type,
+        "count": len(readings),
+        "history": readings
+    })
+
+@app.route("/user/<email>/<data_type>/rollup")
+@conditional()
+def get_rollup(email, data_type):
+    """Get min/max/mean of each field per ?res= (hour, day, week, month) for user, optionally for buckets starting in ?from=&to= and only ?fields="""
+    if data_type not in USER_DATA_TYPES:
+        return jsonify({"error": f"Unknown data type: {data_type}"}), 404
+    if not rollups.has(data_type, email):
+        return jsonify({"error": f"No {data_type.replace('_', ' ')} history found"}), 404
+    
+    args = request.args
+    resolution = args.get('res', 'day')
+    if resolution not in RESOLUTIONS:
+        return jsonify({"error": f"res must be one of {', '.join(RESOLUTIONS)}"}), 400
+    start = to_epoch(args['from']) if 'from' in args else None
+    end = to_epoch(args['to']) if 'to' in args else None
+    if ('from' in args and start is None) or ('to' in args and end is None):
+        return jsonify({"error": "from and to must be ISO 8601 timestamps or Unix times"}), 400
+    fields = set(args['fields'].split(',')) if args.get('fields') else None
+    
+    buckets = rollups.query(data_type, email, resolution, start, end, fields)
+    return jsonify({
+        "user": email,
+        "type": data_type,
+        "resolution": resolution,
+        "buckets": buckets,
+        "slope_per_day": slope_per_day(buckets)
+    })
 
 @app.route("/weight/<email>")
+@conditional(('body_composition',))
 def get_weight_only(email):
     """Get just weight data (compatible with your OpenEMR snippet)"""
-    if email in health_data_store['body_composition']:
-        weight = health_data_store['body_composition'][email]['data'].get('weight')
+    entry = store.get('body_composition', email)
+    if entry is not None:
+        weight = entry['data'].get('weight')
         if weight:
             return jsonify({
                 "weight": weight,
-                "timestamp": health_data_store['body_composition'][email]['timestamp'],
+                "timestamp": entry['timestamp'],
                 "user": email
             })
     
     return jsonify({"error": "No weight data found"}), 404
 
+DEVICES_PAGE = 100
+DEVICES_MAX_PAGE = 1000
+
 @app.route("/devices")
 def list_devices():
-    """List raw device data"""
-    return jsonify(health_data_store['raw'])
+    """List raw device data by device MAC, one page at a time.
+    
+    ?cursor= is the next_cursor of the previous page, null on the last
+    page; ?limit= is the page size. Cursors are MACs, so devices added or
+    evicted in between do not shift the pages.
+    """
+    try:
+        limit = min(int(request.args.get('limit', DEVICES_PAGE)), DEVICES_MAX_PAGE)
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+    if limit < 1:
+        return jsonify({"error": "limit must be >= 1"}), 400
+    cursor = request.args.get('cursor')
+    
+    store.expire('raw')
+    macs = store.keys('raw')
+    start = bisect.bisect_right(macs, cursor) if cursor else 0
+    page = macs[start:start + limit]
+    devices = {}
+    for device_mac in page:
+        entry = store.get('raw', device_mac)
+        if entry is not None:
+            devices[device_mac] = entry
+    next_cursor = page[-1] if start + limit < len(macs) else None
+    return jsonify({"devices": devices, "next_cursor": next_cursor})
 
 @app.route("/device/<device_mac>")
+@conditional(('raw',), key='device_mac')
 def get_device_data(device_mac):
     """Get data for specific device"""
-    if device_mac not in health_data_store['raw']:
+    entry = store.get('raw', device_mac)
+    if entry is None:
         return jsonify({"error": "No data found for device"}), 404
     
-    return jsonify(health_data_store['raw'][device_mac])
+    return jsonify(entry)
+
+EXPORT_CHUNK_SIZE = 64 * 1024  # bytes of NDJSON per chunk sent (before compression)
+
+def export_readings(start, types):
+    """Yield (type, user, timestamp, received_at, data as JSON) of the readings to export.
+
+    With HISTORY_DB everything ever stored is exported, otherwise the
+    history kept in memory (raw: the latest reading of each device).
+    """
+    if database is not None:
+        yield from database.export(start, types)
+        return
+    for data_type, user in history.series():
+        if data_type in types:
+            for entry in history.query(data_type, user, start):
+                yield data_type, user, entry['timestamp'], entry['received_at'], json.dumps(entry['data'])
+    if 'raw' in types:
+        for device_mac in store.keys('raw'):
+            entry = store.get('raw', device_mac)
+            if entry is not None and (start is None or (to_epoch(entry['timestamp']) or to_epoch(entry['received_at'])) >= start):
+                yield 'raw', device_mac, entry['timestamp'], entry['received_at'], json.dumps(entry['data'])
+
+@app.route("/export")
+def export():
+    """Stream readings as newline delimited JSON for bulk imports.
+    
+    One {"user", "type", "timestamp", "received_at", "data"} object per
+    line (user is the device MAC for raw), optionally from ?since= (ISO 8601
+    or Unix time) on and for ?types= (default: all but raw). The response
+    is gzip compressed for clients that accept it.
+    """
+    since = request.args.get('since')
+    start = to_epoch(since) if since else None
+    if since and start is None:
+        return jsonify({"error": "since must be an ISO 8601 timestamp or Unix time"}), 400
+    types = [data_type for data_type in request.args.get('types', '').split(',') if data_type]
+    unknown = set(types) - set(USER_DATA_TYPES + ('raw',))
+    if unknown:
+        return jsonify({"error": f"Unknown data type: {', '.join(sorted(unknown))}"}), 400
+    types = tuple(types) or USER_DATA_TYPES
+    compress = request.accept_encodings.quality('gzip') > 0  # also honours gzip;q=0 and *
+    
+    def generate():
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None  # 31: gzip container
+        lines = []
+        size = 0
+        for data_type, user, timestamp, received_at, data in export_readings(start, types):
+            # data is JSON already, embedded without decoding it again
+            line = (f'{{"user": {json.dumps(user)}, "type": "{data_type}", "timestamp": {json.dumps(timestamp)}, '
+                    f'"received_at": {json.dumps(received_at)}, "data": {data}}}\n')
+            lines.append(line)
+            size += len(line)
+            if size >= EXPORT_CHUNK_SIZE:
+                chunk = ''.join(lines).encode()
+                lines = []
+                size = 0
+                if compressor is not None:
+                    chunk = compressor.compress(chunk)
+                if chunk:
+                    yield chunk
+        chunk = ''.join(lines).encode()
+        if compressor is not None:
+            chunk = compressor.compress(chunk) + compressor.flush()
+        if chunk:
+            yield chunk
+    
+    response = Response(generate(), mimetype='application/x-ndjson')
+    response.headers['Vary'] = 'Accept-Encoding'
+    if compress:
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+CHANGES_PAGE = 100
+CHANGES_MAX_PAGE = 1000
+
+@app.route("/changes")
+def get_changes():
+    """Readings stored after sequence number ?since=, oldest first, for incremental sync.
+    
+    Pass next_since of a response as ?since= of the next request; more is
+    true while further changes are waiting. reset is true when since is
+    not a cursor of this listener (older than the kept log, or from a
+    database or process that is gone): sync fully, e.g. with /export, and
+    continue from next_since.
+    """
+    try:
+        since = int(request.args.get('since', 0))
+        limit = min(int(request.args.get('limit', CHANGES_PAGE)), CHANGES_MAX_PAGE)
+    except ValueError:
+        return jsonify({"error": "since and limit must be integers"}), 400
+    if since < 0 or limit < 1:
+        return jsonify({"error": "since must be >= 0 and limit >= 1"}), 400
+    
+    if database is not None:
+        rows = [(seq, data_type, key, entry) for seq, data_type, key, t, entry in database.follow(since, limit)]
+        last_seq = rows[-1][0] if rows else database.last_id()
+        reset = since > last_seq
+    else:
+        rows = changes.since(since, limit)
+        last_seq = changes.last_seq
+        reset = rows is None
+        if reset:
+            rows = []
+    
+    return jsonify({
+        "changes": [{"seq": seq, "user": key, "type": data_type, **entry} for seq, data_type, key, entry in rows],
+        "next_since": rows[-1][0] if rows else (last_seq if reset else since),
+        "more": len(rows) == limit,
+        "reset": reset
+    })
+
+@app.route("/stream")
+def stream():
+    """Push new readings as Server-Sent Events, optionally only for ?user= and ?type= (comma separated)"""
+    users = [user for user in request.args.get('user', '').split(',') if user]
+    types = [data_type for data_type in request.args.get('type', '').split(',') if data_type]
+    unknown = set(types) - set(health_data_store)
+    if unknown:
+        return jsonify({"error": f"Unknown data type: {', '.join(sorted(unknown))}"}), 400
+    other_shards = group_by_shard(users)
+    if other_shards:
+        owners = sorted(other_shards)
+        if len(owners) == 1 and len(other_shards[owners[0]]) == len(users) and shards.urls:
+            return redirect(shards.urls[owners[0]] + request.full_path.rstrip('?'), 307)
+        # Readings of these users only reach their own shard, open one stream per shard
+        return jsonify({"error": "users of other shards requested",
+                        "other_shards": {str(shard): shard_users(shard, users) for shard, users in other_shards.items()}}), 421
+    subscriber = events.subscribe(users, types)
+    
+    def generate():
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    event = subscriber.queue.get(timeout=STREAM_KEEPALIVE)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                if subscriber.dropped:
+                    # Tell the client it missed readings and should re-fetch
+                    dropped, subscriber.dropped = subscriber.dropped, 0
+                    yield f"event: dropped\ndata: {json.dumps({'dropped': dropped})}\n\n"
+                yield event
+        finally:
+            events.unsubscribe(subscriber)
+    
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route("/latency")
+def get_latency():
+    """Per-stage latency from the device readout to visibility in this API"""
+    return jsonify({
+        "timestamp": datetime.now().isoformat(),
+        "stages": latency.summary(),
+        "sources": metrics_sources,
+        "ingest": ingest.stats() if ingest is not None else None
+    })
+
+@app.route("/metrics")
+def get_metrics():
+    """Prometheus text format metrics"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 if __name__ == "__main__":
-    print("🏥 Health Data API Starting...")
-    print("📡 Connecting to MQTT broker...")
-    app.run(host="0.0.0.0", port=5001, debug=False)
\ No newline at end of file
+    if LISTENER_ROLE == 'ingest':
+        print("🏥 Health Data API ingest process starting, HTTP is served by the api processes...")
+        serve_metrics(metrics, METRICS_PORT)
+        print(f"📈 Metrics on port {METRICS_PORT} at /metrics")
+        print("📡 Connecting to MQTT broker...")
+        if mqtt_thread is not None:
+            mqtt_thread.join()
+    else:
+        print("🏥 Health Data API Starting...")
+        print("📡 Connecting to MQTT broker...")
+        app.run(host="0.0.0.0", port=5001, debug=False)
\ No newline at end of file
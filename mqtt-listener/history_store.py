@@ -0,0 +1,143 @@
+#!/usr/bin/python3
+
+import threading
+from datetime import datetime
+
+DEFAULT_HISTORY_SIZE = 1000  # readings kept per user and measurement type
+
+def to_epoch(value):
+    """Convert a reading timestamp (ISO 8601 string or Unix seconds/milliseconds) to Unix seconds.
+
+    Returns None if the value cannot be interpreted. Naive ISO timestamps
+    are taken as local time, like the publishers write them.
+    """
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        # The Android app sends milliseconds
+        return value / 1000 if value > 1e11 else float(value)
+    if isinstance(value, str):
+        try:
+            return float(value)
+        except ValueError:
+            pass
+        try:
+            return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+        except ValueError:
+            return None
+    return None
+
+
+class TimeSeries:
+    """Fixed-capacity ring buffer of readings ordered by time.
+
+    When full, adding a reading drops the oldest one. Readings normally
+    arrive in time order and are appended in O(1); an older reading (e.g. a
+    replayed outbox) is inserted at its place by rebuilding the buffer.
+    A reading with the same time and timestamp as a kept one is a duplicate
+    and not added.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._times = [0.0] * capacity
+        self._entries = [None] * capacity
+        self._head = 0  # physical index of the oldest reading
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def _time(self, index):
+        return self._times[(self._head + index) % self.capacity]
+
+    def _bisect(self, t, right=False):
+        """Return the first logical index whose time is >= t (> t if right)."""
+        low, high = 0, self._size
+        while low < high:
+            middle = (low + high) // 2
+            if self._time(middle) < t or (right and self._time(middle) == t):
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _contains(self, t, timestamp):
+        index = self._bisect(t)
+        while index < self._size and self._time(index) == t:
+            if self._entries[(self._head + index) % self.capacity]['timestamp'] == timestamp:
+                return True
+            index += 1
+        return False
+
+    def add(self, t, entry):
+        """Add a reading, return False if it is a duplicate."""
+        if self._size and t <= self._time(self._size - 1):
+            if entry['timestamp'] is not None and self._contains(t, entry['timestamp']):
+                return False
+        if self._size and t < self._time(self._size - 1):
+            index = self._bisect(t, right=True)
+            if index == 0 and self._size == self.capacity:
+                return True  # older than everything kept
+            readings = list(zip(self._ordered(self._times), self._ordered(self._entries)))
+            readings.insert(index, (t, entry))
+            readings = readings[-self.capacity:]
+            self._head = 0
+            self._size = len(readings)
+            for position, (reading_time, reading) in enumerate(readings):
+                self._times[position] = reading_time
+                self._entries[position] = reading
+            return True
+        tail = (self._head + self._size) % self.capacity
+        self._times[tail] = t
+        self._entries[tail] = entry
+        if self._size == self.capacity:
+            self._head = (self._head + 1) % self.capacity
+        else:
+            self._size += 1
+        return True
+
+    def _ordered(self, values):
+        return [values[(self._head + index) % self.capacity] for index in range(self._size)]
+
+    def range(self, start=None, end=None, limit=None):
+        """Return the readings with start <= time <= end, oldest first.
+
+        With a limit only the newest limit readings of the range are returned.
+        """
+        low = 0 if start is None else self._bisect(start)
+        high = self._size if end is None else self._bisect(end, right=True)
+        if limit is not None:
+            low = max(low, high - limit)
+        return [self._entries[(self._head + index) % self.capacity] for index in range(low, high)]
+
+
+class HistoryStore:
+    """Thread-safe per-user, per-type reading history in bounded ring buffers."""
+
+    def __init__(self, capacity=DEFAULT_HISTORY_SIZE):
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._series = {}  # (data_type, user) -> TimeSeries
+
+    def add(self, data_type, user, t, entry):
+        """Add a reading taken at Unix time t, return False if it is already kept."""
+        with self._lock:
+            series = self._series.get((data_type, user))
+            if series is None:
+                series = self._series[(data_type, user)] = TimeSeries(self.capacity)
+            return series.add(t, entry)
+
+    def has(self, data_type, user):
+        return (data_type, user) in self._series
+
+    def series(self):
+        """Return the (data_type, user) of every series."""
+        with self._lock:
+            return list(self._series)
+
+    def query(self, data_type, user, start=None, end=None, limit=None):
+        """Return the readings of a user in [start, end] (Unix times), oldest first."""
+        with self._lock:
+            series = self._series.get((data_type, user))
+            return series.range(start, end, limit) if series is not None else []
@@ -0,0 +1,101 @@
+#!/usr/bin/python3
+
+import queue
+import threading
+import time
+import zlib
+
+DEFAULT_WORKERS = 2
+DEFAULT_QUEUE_SIZE = 10000  # messages per worker
+
+
+class IngestPool:
+    """Handle MQTT messages on worker threads instead of paho's network thread.
+
+    submit() is called from on_message and only enqueues, so a slow handler
+    never delays keepalives or socket reads. Messages are partitioned over
+    the workers by topic, so messages of one topic (one user and type) are
+    handled in arrival order. When a worker's queue is full new messages
+    are dropped and counted rather than blocking the network thread,
+    unless the caller asks to wait for room.
+    """
+
+    def __init__(self, handler, workers=DEFAULT_WORKERS, queue_size=DEFAULT_QUEUE_SIZE, latency=None):
+        self.handler = handler  # handler(client, userdata, msg, received_at)
+        self.latency = latency  # LatencyRecorder for the "queue" and "handle" stages, optional
+        self.queue_size = queue_size
+        self._queues = [queue.Queue(maxsize=queue_size) for _ in range(workers)]
+        self._threads = []
+        self._dropping = False
+        self._handled = [0] * workers  # per worker, so workers never update the same counter
+        self.dropped = 0
+
+    @property
+    def handled(self):
+        return sum(self._handled)
+
+    def start(self):
+        for index in range(len(self._queues)):
+            thread = threading.Thread(target=self._worker, args=(index,), name=f"ingest-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self):
+        """Handle the queued messages and stop the workers."""
+        for worker_queue in self._queues:
+            worker_queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def submit(self, client, userdata, msg, key=None, wait=None):
+        """Queue a message for the worker of its key (default: its topic), returns False if it was dropped.
+
+        With wait, a full queue is waited on for up to wait seconds before
+        the message is dropped.
+        """
+        if key is None:
+            key = msg.topic
+        worker_queue = self._queues[zlib.crc32(key.encode('utf-8')) % len(self._queues)]
+        try:
+            if wait:
+                worker_queue.put((client, userdata, msg, time.time()), timeout=wait)
+            else:
+                worker_queue.put_nowait((client, userdata, msg, time.time()))
+        except queue.Full:
+            self.dropped += 1
+            if not self._dropping:
+                self._dropping = True
+                print(f"⚠️ Ingest queue full ({self.queue_size} messages), dropping messages")
+            return False
+        self._dropping = False
+        return True
+
+    def depth(self):
+        """Number of messages waiting in all worker queues."""
+        return sum(worker_queue.qsize() for worker_queue in self._queues)
+
+    def stats(self):
+        return {
+            "workers": len(self._queues),
+            "queue_depth": self.depth(),
+            "queue_size": self.queue_size * len(self._queues),
+            "handled": self.handled,
+            "dropped": self.dropped,
+        }
+
+    def _worker(self, index):
+        worker_queue = self._queues[index]
+        while True:
+            item = worker_queue.get()
+            if item is None:
+                return
+            client, userdata, msg, received_at = item
+            started = time.time()
+            self.handler(client, userdata, msg, received_at)
+            finished = time.time()
+            self._handled[index] += 1
+            if self.latency is not None:
+                self.latency.observe("queue", started - received_at)
+                self.latency.observe("handle", finished - started)
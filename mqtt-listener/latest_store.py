@@ -0,0 +1,175 @@
+#!/usr/bin/python3
+
+import itertools
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+DEFAULT_STRIPES = 16
+
+
+class LatestStore:
+    """Latest reading per type and user (or device), with the summaries the API serves.
+
+    Safe for concurrent ingest workers and Flask request threads:
+
+    - Writers of one user (or device) serialize on one of `stripes` locks
+      chosen by key, so readings of different users are stored in parallel
+      and never wait for a global lock.
+    - Readers take no lock. A lookup of one key sees the old or the new
+      entry, never a mix: entries and per-user summaries are replaced, not
+      changed in place. Listings are served from copy-on-write snapshots
+      that are rebuilt only after a change.
+
+    Types given in `limits` keep at most max_entries keys, evicting the
+    least recently seen one, and hide and drop entries older than ttl
+    seconds, so keys that come and go (raw data per device MAC) cannot
+    grow without bound. Writers of such a type share one lock.
+    """
+
+    def __init__(self, types, user_types, stripes=DEFAULT_STRIPES, limits=None):
+        self.latest = {data_type: {} for data_type in types}  # {data_type: {key: entry}}
+        self.user_types = frozenset(user_types)
+        self.summaries = {}  # {user_email: {data_type: received_at of the latest reading}}
+        self.user_order = []  # user emails in order of their first reading
+        # Version of the readings per type and key for ETag / Last-Modified.
+        # Versions come from one counter, so the highest version of a set of
+        # types changes whenever any of them does. A late reading of a user
+        # bumps it too, it changes the history and rollups. Callers can give
+        # their own increasing versions instead, e.g. database row ids.
+        self.versions = {}  # {(data_type, key): (version, received_at as Unix time)}
+        self.reading_times = {}  # {(data_type, key): Unix time the latest reading was taken}
+        self._version_counter = itertools.count(1)  # next() is atomic
+        self._locks = [threading.Lock() for _ in range(stripes)]
+        self._new_key_lock = threading.Lock()
+        self.data_points = 0  # number of users and devices with a latest reading, summed over types
+        self.last_version = 0  # changes with every stored reading
+        self._snapshots = {}  # {name: (last_version, snapshot)}
+        self.limits = dict(limits or {})  # {data_type: (max_entries, ttl in seconds or None)}
+        self._recent = {data_type: OrderedDict() for data_type in self.limits}  # {key: received_at}, least recent first
+        self._type_locks = {data_type: threading.Lock() for data_type in self.limits}
+        self.evicted = 0
+
+    def _lock(self, data_type, key):
+        type_lock = self._type_locks.get(data_type)
+        if type_lock is not None:
+            return type_lock
+        return self._locks[hash(key) % len(self._locks)]
+
+    def set(self, data_type, key, entry, t=None, version=None):
+        """Make entry, a reading taken at Unix time t, the latest reading of a user (or device) and update the summaries.
+
+        version is the reading's version for ETags, by default the next
+        number of the store's counter.
+
+        A reading older than the current latest one (e.g. replayed from an
+        outbox) is not made the latest; returns False then. For users it
+        still bumps the version, as it goes to their history.
+        """
+        received_at = datetime.fromisoformat(entry['received_at']).timestamp()
+        latest = self.latest[data_type]
+        with self._lock(data_type, key):
+            if t is not None:
+                latest_t = self.reading_times.get((data_type, key))
+                if latest_t is not None and t < latest_t and key in latest:
+                    if data_type in self.user_types:
+                        self._set_version(data_type, key, version, received_at)
+                    return False
+                self.reading_times[(data_type, key)] = t
+            if key not in latest:
+                with self._new_key_lock:
+                    self.data_points += 1
+            latest[key] = entry
+            if data_type in self.user_types:
+                summary = self.summaries.get(key)
+                if summary is None:
+                    self.user_order.append(key)
+                    summary = {}
+                self.summaries[key] = {**summary, data_type: entry['received_at']}
+            recent = self._recent.get(data_type)
+            if recent is not None:
+                recent[key] = received_at
+                recent.move_to_end(key)
+                self._evict(data_type)
+            # Bump the version after the data, so an ETag never belongs to older data
+            if key in latest:
+                self._set_version(data_type, key, version, received_at)
+            else:
+                self.last_version = next(self._version_counter)
+        return True
+
+    def _set_version(self, data_type, key, version, received_at):
+        # Called with the key's lock held
+        counted = next(self._version_counter)
+        current = self.versions.get((data_type, key))
+        if version is None:
+            version = counted
+        elif current is not None and current[0] > version:
+            version = current[0]  # given versions can arrive out of order, e.g. when restoring by time
+        self.versions[(data_type, key)] = (version, received_at)
+        self.last_version = counted
+
+    def _evict(self, data_type):
+        # Called with the type's lock held. Entries are ordered by when they
+        # were stored, so an expired entry behind a newer one stays until it
+        # reaches the front; get() hides it meanwhile.
+        max_entries, ttl = self.limits[data_type]
+        expired_before = time.time() - ttl if ttl else None
+        recent = self._recent[data_type]
+        while recent:
+            key, received_at = next(iter(recent.items()))
+            if len(recent) <= max_entries and (expired_before is None or received_at >= expired_before):
+                break
+            del recent[key]
+            del self.latest[data_type][key]
+            self.versions.pop((data_type, key), None)
+            self.reading_times.pop((data_type, key), None)
+            with self._new_key_lock:
+                self.data_points -= 1
+            self.evicted += 1
+
+    def expire(self, data_type):
+        """Drop the expired entries at the front of a limited type."""
+        with self._type_locks[data_type]:
+            evicted = self.evicted
+            self._evict(data_type)
+            if self.evicted != evicted:
+                self.last_version = next(self._version_counter)
+
+    def _expired(self, data_type, key):
+        limit = self.limits.get(data_type)
+        if limit is None or not limit[1]:
+            return False
+        version = self.versions.get((data_type, key))
+        return version is not None and version[1] < time.time() - limit[1]
+
+    def get(self, data_type, key):
+        """Return the latest entry of a user (or device), None if there is none or it expired."""
+        entry = self.latest[data_type].get(key)
+        if entry is not None and self._expired(data_type, key):
+            return None
+        return entry
+
+    def _snapshot(self, name, build):
+        # Read the version before building, a concurrent write then only
+        # causes one more rebuild
+        version = self.last_version
+        cached = self._snapshots.get(name)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        snapshot = build()
+        self._snapshots[name] = (version, snapshot)
+        return snapshot
+
+    def snapshot(self, data_type):
+        """Return a consistent {key: entry} copy of a type for listing."""
+        return self._snapshot(data_type, self.latest[data_type].copy)
+
+    def keys(self, data_type):
+        """Return the sorted keys of a type, for paging through it."""
+        return self._snapshot(('keys', data_type), lambda: sorted(self.latest[data_type].copy()))
+
+    def summaries_snapshot(self):
+        """Return a consistent {user_email: {data_type: received_at}} copy for /users."""
+        return self._snapshot('summaries', self.summaries.copy)
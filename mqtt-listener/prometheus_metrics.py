@@ -0,0 +1,243 @@
+#!/usr/bin/python3
+
+import atexit
+import bisect
+import json
+import os
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Histogram bucket upper bounds in seconds, for handler and request durations
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                   0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SHARE_INTERVAL = 5  # seconds between writes of a process's counters to the shared directory
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class MetricsRegistry:
+    """Counters, histograms and gauges rendered in the Prometheus text format.
+
+    Counters and histograms are updated without a lock: every thread
+    writes only to its own cell, a dict of {(metric, label values): value}.
+    render() sums the cells; cells of threads that have ended are folded
+    into a shared total so short-lived request threads do not pile up.
+    Gauges are read from callbacks at render time.
+
+    Processes that serve the same app (gunicorn workers) can share() a
+    directory: each writes its counters and histograms there and render()
+    sums the files of all of them. Gauges stay per process.
+    """
+
+    def __init__(self):
+        self._metrics = []  # registration order
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._cells = {}  # id(cell) -> (thread, cell); thread idents can be reused
+        self._retired = {}  # summed cells of finished threads
+        self._shared_file = None
+
+    def _cell(self):
+        try:
+            return self._local.cell
+        except AttributeError:
+            cell = self._local.cell = {}
+            with self._lock:
+                self._cells[id(cell)] = (threading.current_thread(), cell)
+            return cell
+
+    def counter(self, name, help_text, labels=()):
+        return self._register(Counter(self, name, help_text, labels))
+
+    def histogram(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(self, name, help_text, labels, buckets))
+
+    def gauge(self, name, help_text, collect, labels=(), kind='gauge'):
+        """collect() returns {label values tuple: value}, or a number when there are no labels.
+
+        kind='counter' exposes a total kept elsewhere, e.g. a queue's drop count.
+        """
+        return self._register(Gauge(self, name, help_text, labels, collect, kind))
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def _collect(self):
+        """Return the summed {(metric, label values): value} of all threads."""
+        with self._lock:
+            for cell_id, (thread, cell) in list(self._cells.items()):
+                if not thread.is_alive():
+                    _merge(self._retired, cell)
+                    del self._cells[cell_id]
+            totals = {}
+            _merge(totals, self._retired)
+            live = [cell for thread, cell in self._cells.values()]
+        for cell in live:
+            _merge(totals, cell)
+        return totals
+
+    def share(self, directory, interval=SHARE_INTERVAL):
+        """Write this process's totals to directory every interval seconds, and render the sum of all processes there.
+
+        Files of exited processes are kept so their counts do not go back;
+        clear the directory when the service (re)starts, e.g. use a tmpfs.
+        """
+        os.makedirs(directory, exist_ok=True)
+        self._shared_file = os.path.join(directory, f"{socket.gethostname()}-{os.getpid()}.json")
+        self._write_shared(self._collect())
+        atexit.register(lambda: self._write_shared(self._collect()))
+
+        def write_periodically():
+            while True:
+                time.sleep(interval)
+                self._write_shared(self._collect())
+
+        threading.Thread(target=write_periodically, daemon=True).start()
+
+    def _write_shared(self, totals):
+        temporary = self._shared_file + '.tmp'
+        with open(temporary, 'w') as f:
+            json.dump([[name, list(label_values), value] for (name, label_values), value in totals.items()], f)
+        os.replace(temporary, self._shared_file)  # readers never see a partial file
+
+    def _read_shared(self):
+        directory = os.path.dirname(self._shared_file)
+        totals = {}
+        for filename in os.listdir(directory):
+            if not filename.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(directory, filename)) as f:
+                    entries = json.load(f)
+            except (OSError, ValueError):
+                continue  # removed or written by something else
+            _merge(totals, {(name, tuple(label_values)): value for name, label_values, value in entries})
+        return totals
+
+    def render(self):
+        totals = self._collect()
+        if self._shared_file is not None:
+            self._write_shared(totals)
+            totals = self._read_shared()
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.render(totals))
+        return '\n'.join(lines) + '\n'
+
+def _merge(totals, cell):
+    # dict() and list() copies of another thread's cell are atomic under the GIL
+    for key, value in dict(cell).items():
+        if isinstance(value, list):
+            value = list(value)
+            current = totals.get(key)
+            totals[key] = value if current is None else [a + b for a, b in zip(current, value)]
+        else:
+            totals[key] = totals.get(key, 0) + value
+
+def serve(registry, port, host='0.0.0.0'):
+    """Serve registry at http://host:port/metrics from a daemon thread, for processes without a web app."""
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?', 1)[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # scrapes would flood the log
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self, registry, name, help_text, labels):
+        self.registry = registry
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+
+    def inc(self, *label_values, amount=1):
+        cell = self.registry._cell()
+        key = (self.name, label_values)
+        cell[key] = cell.get(key, 0) + amount
+
+    def render(self, totals):
+        return [f"{self.name}{_format_labels(self.labels, label_values)} {_format_value(value)}"
+                for (name, label_values), value in sorted(totals.items(), key=lambda item: item[0]) if name == self.name]
+
+
+class Histogram:
+    type = 'histogram'
+
+    def __init__(self, registry, name, help_text, labels, buckets):
+        self.registry = registry
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *label_values):
+        cell = self.registry._cell()
+        key = (self.name, label_values)
+        counts = cell.get(key)
+        if counts is None:
+            # One count per bucket plus +Inf, then the sum
+            counts = cell[key] = [0] * (len(self.buckets) + 2)
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def render(self, totals):
+        lines = []
+        for (name, label_values), counts in sorted(totals.items(), key=lambda item: item[0]):
+            if name != self.name:
+                continue
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, label_values, [('le', _format_value(bound))])} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, label_values)} {_format_value(counts[-1])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, label_values)} {cumulative}")
+        return lines
+
+
+class Gauge:
+
+    def __init__(self, registry, name, help_text, labels, collect, kind='gauge'):
+        self.type = kind
+        self.registry = registry
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.collect = collect
+
+    def render(self, totals):
+        values = self.collect()
+        if not isinstance(values, dict):
+            values = {(): values}
+        return [f"{self.name}{_format_labels(self.labels, label_values)} {_format_value(value)}"
+                for label_values, value in values.items()]
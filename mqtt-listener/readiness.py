@@ -0,0 +1,76 @@
+#!/usr/bin/python3
+
+import threading
+import time
+
+DEFAULT_QUIET = 1.0     # seconds without a retained message that end the warm start
+DEFAULT_TIMEOUT = 30.0  # longest warm start, for brokers that keep sending
+
+
+class Readiness:
+    """Track the warm start of the listener.
+
+    After subscribing, the broker sends every retained message at once.
+    The listener is ready when no retained message arrived for `quiet`
+    seconds and the ingest queue is empty, or `timeout` seconds after
+    subscribing. Once ready it stays ready, also across reconnects.
+    """
+
+    def __init__(self, quiet=DEFAULT_QUIET, timeout=DEFAULT_TIMEOUT):
+        self.quiet = quiet
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self.subscribed_at = None
+        self.last_retained_at = None
+        self.retained = 0
+        self.retained_dropped = 0  # retained messages the ingest queue had no room for
+        self.ready_at = None
+
+    @property
+    def warming(self):
+        return self.ready_at is None
+
+    def subscribed(self):
+        """Called when the subscriptions were sent, starts the warm start."""
+        with self._lock:
+            if self.subscribed_at is None:
+                self.subscribed_at = self.last_retained_at = time.time()
+
+    def retained_received(self, queued=True):
+        """Called for every retained message as it arrives; queued is False if it was dropped."""
+        if self.ready_at is None:
+            self.last_retained_at = time.time()
+            if queued:
+                self.retained += 1
+            else:
+                self.retained_dropped += 1
+
+    def mark_ready(self):
+        with self._lock:
+            if self.ready_at is None:
+                self.ready_at = time.time()
+                return True
+        return False
+
+    def check(self, pending=0):
+        """Return True if ready; pending is the number of messages still queued for handling."""
+        if self.ready_at is not None:
+            return True
+        if self.subscribed_at is None:
+            return False
+        now = time.time()
+        if (now - self.last_retained_at >= self.quiet and not pending) or now - self.subscribed_at >= self.timeout:
+            if self.mark_ready():
+                print(f"🔥 Warm start done: {self.retained} retained messages in {self.ready_at - self.subscribed_at:.1f}s"
+                      + (f", {self.retained_dropped} dropped" if self.retained_dropped else ""))
+            return True
+        return False
+
+    def status(self):
+        return {
+            "ready": self.ready_at is not None,
+            "retained_messages": self.retained,
+            "retained_dropped": self.retained_dropped,
+            "warmup_seconds": round(self.ready_at - self.subscribed_at, 3)
+                              if self.ready_at is not None and self.subscribed_at is not None else None,
+        }
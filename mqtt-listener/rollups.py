@@ -0,0 +1,113 @@
+#!/usr/bin/python3
+
+import threading
+from datetime import datetime, timedelta
+
+def _day(moment):
+    return datetime(moment.year, moment.month, moment.day)
+
+# Bucket start of a local datetime per resolution; weeks start on Monday
+RESOLUTIONS = {
+    'hour': lambda moment: moment.replace(minute=0, second=0, microsecond=0),
+    'day': _day,
+    'week': lambda moment: _day(moment) - timedelta(days=moment.weekday()),
+    'month': lambda moment: datetime(moment.year, moment.month, 1),
+}
+
+# Buckets kept per user, type and resolution, the oldest are dropped:
+# about 3 months of hours, 3 years of days, 5 years of weeks and 10 years of months
+RETENTION = {'hour': 24 * 92, 'day': 3 * 366, 'week': 5 * 53, 'month': 10 * 12}
+
+# Measurement fields aggregated per type, as published by mqtt_publisher.py
+# and the Android app. Other numeric fields (timestamps, ages, battery
+# levels) are not measurements.
+ROLLUP_FIELDS = {
+    'body_composition': ('weight', 'bmi', 'body_fat_percent', 'fat_percentage', 'muscle_mass', 'bone_mass',
+                         'water_percent', 'water_percentage', 'visceral_fat', 'metabolic_age', 'bmr', 'lbm',
+                         'ideal_weight', 'protein_percent', 'protein_percentage', 'impedance'),
+    'blood_pressure': ('systolic', 'diastolic', 'pulse'),
+    'temperature': ('temperature_celsius', 'temperature_fahrenheit'),
+    'pulse_oximetry': ('spo2_percentage', 'pulse_rate'),
+}
+
+
+class RollupStore:
+    """Min/max/mean of every numeric measurement field per user, type and time bucket.
+
+    Buckets are local hours, days, ISO weeks and months. Adding a reading
+    updates one bucket per resolution in O(1), whatever its time, so trend
+    queries never have to scan the raw readings. Only the `fields` of a
+    type are aggregated, and only the newest `retention` buckets per
+    resolution are kept.
+    """
+
+    def __init__(self, resolutions=tuple(RESOLUTIONS), fields=ROLLUP_FIELDS, retention=RETENTION):
+        self.resolutions = resolutions
+        self.fields = fields
+        self.retention = retention
+        self._lock = threading.Lock()
+        # {(data_type, user, resolution): {bucket start (Unix time): {field: [count, min, max, sum]}}}
+        self._buckets = {}
+
+    def add(self, data_type, user, t, data):
+        """Add the measurement fields of a reading taken at Unix time t."""
+        values = [(field, data[field]) for field in self.fields.get(data_type, ())
+                  if isinstance(data.get(field), (int, float)) and not isinstance(data[field], bool)]
+        if not values:
+            return
+        moment = datetime.fromtimestamp(t)
+        with self._lock:
+            for resolution in self.resolutions:
+                start = RESOLUTIONS[resolution](moment).timestamp()
+                series = self._buckets.setdefault((data_type, user, resolution), {})
+                bucket = series.get(start)
+                if bucket is None:
+                    bucket = series[start] = {}
+                    if len(series) > self.retention[resolution]:
+                        del series[min(series)]
+                for field, value in values:
+                    stats = bucket.get(field)
+                    if stats is None:
+                        bucket[field] = [1, value, value, value]
+                    else:
+                        stats[0] += 1
+                        stats[1] = min(stats[1], value)
+                        stats[2] = max(stats[2], value)
+                        stats[3] += value
+
+    def has(self, data_type, user):
+        return (data_type, user, self.resolutions[0]) in self._buckets
+
+    def query(self, data_type, user, resolution, start=None, end=None, fields=None):
+        """Return the buckets of a user starting in [start, end] (Unix times), oldest first.
+
+        Each bucket is {"start", "fields": {field: {"count", "min", "max", "mean"}}}.
+        """
+        with self._lock:
+            series = self._buckets.get((data_type, user, resolution), {})
+            selected = sorted((bucket_start, {field: list(stats) for field, stats in bucket.items()
+                                              if fields is None or field in fields})
+                              for bucket_start, bucket in series.items()
+                              if (start is None or bucket_start >= start) and (end is None or bucket_start <= end))
+        return [{
+            "start": datetime.fromtimestamp(bucket_start).isoformat(),
+            "fields": {field: {"count": count, "min": low, "max": high, "mean": total / count}
+                       for field, (count, low, high, total) in bucket.items()}
+        } for bucket_start, bucket in selected if bucket]
+
+def slope_per_day(buckets):
+    """Least-squares slope of each field's bucket means, in units per day."""
+    points = {}
+    for bucket in buckets:
+        day = datetime.fromisoformat(bucket["start"]).timestamp() / 86400
+        for field, stats in bucket["fields"].items():
+            points.setdefault(field, []).append((day, stats["mean"]))
+    slopes = {}
+    for field, field_points in points.items():
+        if len(field_points) < 2:
+            continue
+        mean_x = sum(x for x, y in field_points) / len(field_points)
+        mean_y = sum(y for x, y in field_points) / len(field_points)
+        spread = sum((x - mean_x) ** 2 for x, y in field_points)
+        slopes[field] = sum((x - mean_x) * (y - mean_y) for x, y in field_points) / spread
+    return slopes
@@ -0,0 +1,60 @@
+#!/usr/bin/python3
+
+import zlib
+
+# Messages a replica received for a user of another shard are republished
+# under <SHARD_TOPIC>/<shard>/<original topic>
+SHARD_TOPIC = 'healthdata-shard'
+
+def normalize_key(key):
+    """Return a user email or device MAC in topic form, john.doe@example.com -> john_doe_at_example_com.
+
+    The email decoded from a topic can differ from the one in the payload
+    in '.' versus '_', both normalize to the same key.
+    """
+    return key.lower().replace('@', '_at_').replace('.', '_')
+
+def shared_subscription(topic_filter, group):
+    """Return the MQTT shared subscription of a topic filter, the broker hands each message to one member of group."""
+    return f"$share/{group}/{topic_filter}"
+
+
+class Shards:
+    """Consistent partitioning of users (and devices) over listener replicas.
+
+    A user belongs to shard crc32(key) % count, the same on every replica
+    and for the MQTT and HTTP side. Keys are hashed in their normalized
+    topic form, see normalize_key().
+    """
+
+    def __init__(self, count=1, index=0, urls=()):
+        if not 0 <= index < count:
+            raise ValueError(f"shard index {index} is not in 0..{count - 1}")
+        if urls and len(urls) != count:
+            raise ValueError(f"{len(urls)} shard URLs given for {count} shards")
+        self.count = count
+        self.index = index
+        self.urls = [url.rstrip('/') for url in urls]  # base URL of each shard's API, for redirects
+
+    @property
+    def enabled(self):
+        return self.count > 1
+
+    def owner(self, key):
+        return zlib.crc32(normalize_key(key).encode()) % self.count
+
+    def owns(self, key):
+        return self.count == 1 or self.owner(key) == self.index
+
+    def forward_topic(self, shard, topic):
+        return f"{SHARD_TOPIC}/{shard}/{topic}"
+
+    def inbox(self):
+        """Return the topic filter of the messages forwarded to this shard."""
+        return f"{SHARD_TOPIC}/{self.index}/#"
+
+    def unwrap(self, topic):
+        """Return the original topic of a forwarded message, other topics unchanged."""
+        if topic.startswith(SHARD_TOPIC + '/'):
+            return topic.split('/', 2)[2]
+        return topic
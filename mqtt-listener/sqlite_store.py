@@ -0,0 +1,202 @@
+#!/usr/bin/python3
+
+import json
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS readings (
+    id INTEGER PRIMARY KEY,
+    user TEXT NOT NULL,         -- user email, or device MAC for raw scale data
+    type TEXT NOT NULL,         -- health_data_store key, e.g. blood_pressure or raw
+    t REAL NOT NULL,            -- reading time, Unix seconds
+    timestamp TEXT,             -- reading time as published
+    received_at TEXT NOT NULL,
+    data TEXT NOT NULL          -- measurement fields as JSON
+);
+CREATE INDEX IF NOT EXISTS readings_user_type_t ON readings (user, type, t);
+"""
+
+# A reading resent by a publisher (e.g. replayed from its outbox) has the
+# same user, type and timestamp; readings without a timestamp never clash
+UNIQUE_INDEX = "CREATE UNIQUE INDEX IF NOT EXISTS readings_unique ON readings (user, type, timestamp)"
+DROP_DUPLICATES = """
+DELETE FROM readings WHERE timestamp IS NOT NULL AND id NOT IN (
+    SELECT MIN(id) FROM readings WHERE timestamp IS NOT NULL GROUP BY user, type, timestamp)
+"""
+
+INSERT = "INSERT OR IGNORE INTO readings (user, type, t, timestamp, received_at, data) VALUES (?, ?, ?, ?, ?, ?)"
+
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_QUEUE_SIZE = 10000
+READER_POOL_SIZE = 4  # idle read connections kept for follow() and last_id()
+
+def connect(path):
+    """Open the database in WAL mode, creating the schema if needed."""
+    connection = sqlite3.connect(path)
+    connection.execute("PRAGMA journal_mode=WAL")
+    # With WAL, NORMAL only syncs at checkpoints and cannot corrupt the database
+    connection.execute("PRAGMA synchronous=NORMAL")
+    connection.executescript(SCHEMA)
+    if connection.execute("SELECT 1 FROM sqlite_master WHERE name = 'readings_unique'").fetchone() is None:
+        # Databases from before the index may hold duplicates
+        with connection:
+            connection.execute(DROP_DUPLICATES)
+            connection.execute(UNIQUE_INDEX)
+    return connection
+
+def connect_reader(path):
+    """Open a read-only connection to a database connect() has set up.
+
+    WAL mode is a property of the database file, so there is nothing to
+    configure per connection.
+    """
+    connection = sqlite3.connect(path, check_same_thread=False)
+    connection.execute("PRAGMA query_only=ON")
+    return connection
+
+def _entry(timestamp, received_at, data):
+    """Rebuild a health_data_store entry from a readings row."""
+    return {
+        'timestamp': timestamp,
+        'received_at': received_at,
+        'data': json.loads(data)
+    }
+
+
+class SQLiteStore:
+    """Persist readings to SQLite from a single batching writer thread.
+
+    put() only enqueues, so ingest never waits for a commit. The writer
+    takes whatever is queued (up to batch_size readings) and commits it in
+    one transaction, so the fsync cost is shared by the whole batch. When
+    the queue is full, put() blocks until the writer catches up.
+    """
+
+    def __init__(self, path, batch_size=DEFAULT_BATCH_SIZE, queue_size=DEFAULT_QUEUE_SIZE):
+        self.path = path
+        self.batch_size = batch_size
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._readers = queue.LifoQueue(maxsize=READER_POOL_SIZE)  # idle connections of _reader()
+        self.written = 0
+        connect(path).close()
+
+    def start(self):
+        """Start the writer thread."""
+        self._thread = threading.Thread(target=self._writer, daemon=True)
+        self._thread.start()
+        return self
+
+    def put(self, data_type, user, t, entry):
+        """Queue a reading taken at Unix time t for writing."""
+        self._queue.put((user, data_type, t, entry['timestamp'], entry['received_at'], json.dumps(entry['data'])))
+
+    def close(self):
+        """Write everything queued so far and stop the writer thread."""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+        while not self._readers.empty():
+            self._readers.get_nowait().close()
+
+    def _writer(self):
+        connection = connect(self.path)
+        running = True
+        while running:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if None in batch:
+                running = False
+                batch = [row for row in batch if row is not None]
+            try:
+                changes = connection.total_changes
+                with connection:
+                    connection.executemany(INSERT, batch)
+                self.written += connection.total_changes - changes  # without ignored duplicates
+            except sqlite3.Error as e:
+                print(f"❌ SQLite write of {len(batch)} readings failed: {e}")
+        connection.close()
+
+    @contextmanager
+    def _reader(self):
+        """Borrow a read connection from the pool, opening one if none is idle.
+
+        Request threads come and go, so connections are not tied to them;
+        those beyond READER_POOL_SIZE are closed when given back.
+        """
+        try:
+            connection = self._readers.get_nowait()
+        except queue.Empty:
+            connection = connect_reader(self.path)
+        try:
+            yield connection
+        finally:
+            try:
+                self._readers.put_nowait(connection)
+            except queue.Full:
+                connection.close()
+
+    def last_id(self):
+        """Return the id of the newest written reading, 0 if there is none."""
+        with self._reader() as connection:
+            return connection.execute("SELECT COALESCE(MAX(id), 0) FROM readings").fetchone()[0]
+
+    def load(self, limit, up_to_id=None):
+        """Yield (id, type, user, t, entry) of the newest limit readings of each user and type, oldest first.
+
+        With up_to_id only readings with an id up to it are loaded, follow()
+        then continues from there.
+        """
+        connection = connect_reader(self.path)
+        try:
+            if up_to_id is None:
+                up_to_id = connection.execute("SELECT COALESCE(MAX(id), 0) FROM readings").fetchone()[0]
+            series = connection.execute("SELECT DISTINCT user, type FROM readings").fetchall()
+            for user, data_type in series:
+                rows = connection.execute(
+                    "SELECT id, t, timestamp, received_at, data FROM readings"
+                    " WHERE user = ? AND type = ? AND id <= ? ORDER BY t DESC LIMIT ?",
+                    (user, data_type, up_to_id, limit)).fetchall()
+                for row_id, t, timestamp, received_at, data in reversed(rows):
+                    yield row_id, data_type, user, t, _entry(timestamp, received_at, data)
+        finally:
+            connection.close()
+
+    def export(self, start=None, types=None):
+        """Yield (type, user, timestamp, received_at, data as JSON) of the readings taken from Unix time start on, in write order.
+
+        Rows are fetched as they are consumed, so exporting the whole
+        database does not load it into memory.
+        """
+        query = "SELECT type, user, timestamp, received_at, data FROM readings WHERE t >= ?"
+        params = [start if start is not None else float('-inf')]
+        if types is not None:
+            query += f" AND type IN ({', '.join('?' * len(types))})"
+            params.extend(types)
+        connection = connect_reader(self.path)
+        try:
+            yield from connection.execute(query + " ORDER BY id", params)
+        finally:
+            connection.close()
+
+    def follow(self, after_id, limit=DEFAULT_BATCH_SIZE):
+        """Return up to limit (id, type, user, t, entry) written after reading after_id, in write order.
+
+        Lets processes that do not ingest themselves (LISTENER_ROLE=api)
+        pick up what the ingest process writes. Ids are assigned in write
+        order, so they also serve as the sequence numbers of /changes.
+        """
+        with self._reader() as connection:
+            rows = connection.execute(
+                "SELECT id, type, user, t, timestamp, received_at, data FROM readings"
+                " WHERE id > ? ORDER BY id LIMIT ?", (after_id, limit)).fetchall()
+        return [(row_id, data_type, user, t, _entry(timestamp, received_at, data))
+                for row_id, data_type, user, t, timestamp, received_at, data in rows]
@@ -0,0 +1,84 @@
+#!/usr/bin/python3
+
+from collections import namedtuple
+
+# A routed topic: layout ("health" or "healthdata"), measurement type and the
+# user email or device MAC the message belongs to
+Route = namedtuple('Route', ['schema', 'data_type', 'key'])
+
+# Topic patterns of both publishers, more specific patterns first.
+# {type}, {user} and {device} match one topic level.
+TOPIC_ROUTES = (
+    # mqtt_publisher.py: health/<type>/<user>, health/raw/<mac>
+    ("health/raw/{device}", "health", "raw_scale_data"),
+    ("health/{type}/{user}", "health", None),
+    # Android app and listener: healthdata/<user>/<type>
+    ("healthdata/metrics", "healthdata", "metrics"),
+    ("healthdata/devices/discovery", "healthdata", "discovery"),
+    ("healthdata/devices/{device}/raw_scale_data", "healthdata", "raw_scale_data"),
+    ("healthdata/{user}/{type}", "healthdata", None),
+)
+
+def topic_to_email(level):
+    """Undo the topic sanitizing of an email, john_at_example_com -> john@example.com."""
+    return level.replace('_at_', '@').replace('_', '.')
+
+
+class TopicRouter:
+    """Map MQTT topics to a Route through precompiled patterns.
+
+    Patterns are indexed by their first level and number of levels, so a
+    topic is only compared with the few patterns that can match it. The
+    result, including the email decoded from the topic, is cached per topic;
+    a known topic costs one dict lookup.
+    """
+
+    def __init__(self, routes=TOPIC_ROUTES, cache_size=10000):
+        self.cache_size = cache_size
+        self._cache = {}
+        self._patterns = {}  # (first level, number of levels) -> [(levels, schema, data_type)]
+        self._filters = []
+        for pattern, schema, data_type in routes:
+            levels = tuple(pattern.split('/'))
+            self._patterns.setdefault((levels[0], len(levels)), []).append((levels, schema, data_type))
+            self._filters.append('/'.join('+' if level.startswith('{') else level for level in levels))
+
+    def subscriptions(self):
+        """Return the topic filters needed for all routes, without overlapping ones."""
+        def covers(wide, narrow):
+            wide, narrow = wide.split('/'), narrow.split('/')
+            return len(wide) == len(narrow) and all(w == '+' or w == n for w, n in zip(wide, narrow))
+        filters = []
+        for topic_filter in self._filters:
+            if topic_filter not in filters and not any(covers(other, topic_filter) for other in self._filters if other != topic_filter):
+                filters.append(topic_filter)
+        return filters
+
+    def _match(self, topic):
+        levels = topic.split('/')
+        for pattern, schema, data_type in self._patterns.get((levels[0], len(levels)), ()):
+            captured = {}
+            for pattern_level, level in zip(pattern, levels):
+                if pattern_level.startswith('{'):
+                    captured[pattern_level[1:-1]] = level
+                elif pattern_level != level:
+                    break
+            else:
+                if 'user' in captured:
+                    key = topic_to_email(captured['user'])
+                else:
+                    key = captured.get('device')
+                return Route(schema, data_type or captured['type'], key)
+        return None
+
+    def route(self, topic):
+        """Return the Route of a topic, None if no pattern matches."""
+        try:
+            return self._cache[topic]
+        except KeyError:
+            pass
+        route = self._match(topic)
+        if len(self._cache) >= self.cache_size:
+            self._cache.clear()
+        self._cache[topic] = route
+        return route
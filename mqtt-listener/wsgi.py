@@ -0,0 +1,18 @@
+#!/usr/bin/python3
+
+# WSGI entry point for serving the API from several worker processes:
+#
+#   LISTENER_ROLE=ingest HISTORY_DB=/data/health_data.db python health_data_api.py
+#   HISTORY_DB=/data/health_data.db gunicorn -w 4 -k gthread --threads 8 -b 0.0.0.0:5001 wsgi:app
+#
+# Exactly one ingest process subscribes to MQTT and writes HISTORY_DB. Each
+# worker imported from here runs as LISTENER_ROLE=api: it does not connect
+# to MQTT, loads HISTORY_DB and then follows what the ingest process
+# writes. Do not use gunicorn --preload, the follower thread has to start
+# in each worker, not in the master before the fork.
+
+import os
+
+os.environ.setdefault('LISTENER_ROLE', 'api')
+
+from health_data_api import app
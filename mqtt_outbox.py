@@ -0,0 +1,206 @@
+#!/usr/bin/python3
+
+import os
+import fcntl
+import struct
+import threading
+import zlib
+
+# Record header: sequence number, qos, retain flag, topic length, payload length
+RECORD_HEADER = struct.Struct('>QBBHI')
+RECORD_CRC = struct.Struct('>I')
+
+# Acks between writes of the watermark file. A crash resends at most this
+# many acknowledged messages; the listener ignores a reading whose user,
+# type and timestamp it already stored.
+WATERMARK_WRITE_INTERVAL = 100
+
+class MQTTOutbox:
+    """Segmented, append-only on-disk store for messages waiting for a broker ack.
+
+    Every message is appended once to the newest segment file and gets an
+    increasing sequence number. Acknowledged sequence numbers advance a
+    watermark that is written to the "acked" file every
+    WATERMARK_WRITE_INTERVAL acks and by flush_acks(); segments entirely
+    below the written watermark are deleted. After a restart all messages above the watermark
+    are replayed in order. A record torn by a crash fails its CRC check and
+    is dropped together with everything after it in that segment.
+    """
+
+    def __init__(self, directory, segment_size=1024 * 1024):
+        """Open (or create) the outbox in directory."""
+        self.directory = directory
+        self.segment_size = segment_size
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+        # Only one process may own the outbox, raises BlockingIOError otherwise
+        self._lock_file = open(os.path.join(directory, 'lock'), 'w')
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            self._lock_file.close()
+            raise
+
+        self._acked_path = os.path.join(directory, 'acked')
+        self._watermark = self._read_watermark()
+        self._saved_watermark = self._watermark
+        self._acked_above = set()  # acked sequence numbers above the watermark
+        self._segments = []  # [first_seq, last_seq, path], oldest first
+        self._next_seq = self._watermark + 1
+        self._active = None
+
+        for name in sorted(os.listdir(directory)):
+            if name.endswith('.seg'):
+                self._open_segment(os.path.join(directory, name))
+        self._delete_acked_segments()
+
+    def _read_watermark(self):
+        try:
+            with open(self._acked_path, 'r') as file:
+                return int(file.read().strip() or 0)
+        except (OSError, ValueError):
+            return 0
+
+    def _write_watermark(self):
+        tmp_path = self._acked_path + '.tmp'
+        with open(tmp_path, 'w') as file:
+            file.write(str(self._watermark))
+        os.replace(tmp_path, self._acked_path)
+        self._saved_watermark = self._watermark
+        self._delete_acked_segments()
+
+    @staticmethod
+    def _read_records(path):
+        """Yield (offset, seq, topic, payload, qos, retain) for the valid records of a segment."""
+        with open(path, 'rb') as file:
+            data = file.read()
+        offset = 0
+        while offset + RECORD_HEADER.size <= len(data):
+            seq, qos, retain, topic_len, payload_len = RECORD_HEADER.unpack_from(data, offset)
+            body_start = offset + RECORD_HEADER.size
+            end = body_start + topic_len + payload_len + RECORD_CRC.size
+            if end > len(data):
+                return
+            body_end = end - RECORD_CRC.size
+            crc, = RECORD_CRC.unpack_from(data, body_end)
+            if crc != zlib.crc32(data[offset:body_end]):
+                return
+            topic = data[body_start:body_start + topic_len].decode('utf-8')
+            payload = data[body_start + topic_len:body_end]
+            yield offset, seq, topic, payload, qos, bool(retain)
+            offset = end
+
+    def _open_segment(self, path):
+        """Index an existing segment and cut off a torn tail."""
+        first_seq = last_seq = None
+        valid_end = 0
+        for offset, seq, topic, payload, qos, retain in self._read_records(path):
+            if first_seq is None:
+                first_seq = seq
+            last_seq = seq
+            valid_end = offset + RECORD_HEADER.size + len(topic.encode('utf-8')) + len(payload) + RECORD_CRC.size
+        if first_seq is None:
+            os.remove(path)
+            return
+        if os.path.getsize(path) > valid_end:
+            with open(path, 'r+b') as file:
+                file.truncate(valid_end)
+        self._segments.append([first_seq, last_seq, path])
+        self._next_seq = max(self._next_seq, last_seq + 1)
+
+    def _delete_acked_segments(self):
+        """Remove segments whose messages are all acknowledged."""
+        while self._segments and self._segments[0][1] <= self._saved_watermark:
+            first_seq, last_seq, path = self._segments.pop(0)
+            if self._active is not None and self._active.name == path:
+                self._active.close()
+                self._active = None
+            os.remove(path)
+
+    def append(self, topic, payload, qos, retain):
+        """Append a message and return its sequence number.
+
+        The record is flushed to the OS; call sync() to force it to disk.
+        """
+        topic_bytes = topic.encode('utf-8')
+        with self._lock:
+            seq = self._next_seq
+            self._next_seq += 1
+            record = RECORD_HEADER.pack(seq, qos, int(bool(retain)), len(topic_bytes), len(payload)) + topic_bytes + payload
+            record += RECORD_CRC.pack(zlib.crc32(record))
+
+            segment = self._segments[-1] if self._segments else None
+            if segment is None or os.path.getsize(segment[2]) >= self.segment_size:
+                path = os.path.join(self.directory, f"{seq:020d}.seg")
+                segment = [seq, seq, path]
+                self._segments.append(segment)
+            if self._active is None or self._active.name != segment[2]:
+                if self._active is not None:
+                    self._active.close()
+                self._active = open(segment[2], 'ab')
+            self._active.write(record)
+            self._active.flush()
+            segment[1] = seq
+            return seq
+
+    def sync(self):
+        """Force appended messages to disk."""
+        with self._lock:
+            if self._active is not None:
+                os.fsync(self._active.fileno())
+
+    def ack(self, seq):
+        """Mark a message as delivered and truncate what is no longer needed."""
+        with self._lock:
+            if seq <= self._watermark:
+                return
+            self._acked_above.add(seq)
+            advanced = False
+            while self._watermark + 1 in self._acked_above:
+                self._watermark += 1
+                self._acked_above.discard(self._watermark)
+                advanced = True
+            if advanced and self._watermark - self._saved_watermark >= WATERMARK_WRITE_INTERVAL:
+                self._write_watermark()
+
+    def flush_acks(self):
+        """Write the watermark of the acks so far, e.g. at the end of a drain."""
+        with self._lock:
+            if self._watermark != self._saved_watermark:
+                self._write_watermark()
+
+    def pending(self, limit=None):
+        """Return up to limit unacknowledged (seq, topic, payload, qos, retain) tuples, oldest first."""
+        with self._lock:
+            if self._active is not None:
+                self._active.flush()
+            segments = [segment[2] for segment in self._segments]
+            watermark = self._watermark
+            acked_above = set(self._acked_above)
+        messages = []
+        for path in segments:
+            try:
+                for offset, seq, topic, payload, qos, retain in self._read_records(path):
+                    if seq > watermark and seq not in acked_above:
+                        messages.append((seq, topic, payload, qos, retain))
+                        if limit is not None and len(messages) >= limit:
+                            return messages
+            except FileNotFoundError:
+                # Segment was truncated away by a concurrent ack
+                continue
+        return messages
+
+    def __len__(self):
+        """Number of messages not yet acknowledged."""
+        with self._lock:
+            return self._next_seq - 1 - self._watermark - len(self._acked_above)
+
+    def close(self):
+        """Close the active segment file and release the outbox."""
+        self.flush_acks()
+        with self._lock:
+            if self._active is not None:
+                self._active.close()
+                self._active = None
+            self._lock_file.close()
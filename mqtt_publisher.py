@@ -1,24 +1,108 @@
 #!/usr/bin/python3
 
 import paho.mqtt.client as mqtt
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
 import json
+import socket
+import threading
 import time
 from datetime import datetime
+from mqtt_outbox import MQTTOutbox
+from latency_metrics import LatencyRecorder, METRICS_TOPIC
+import health_codec
+
+# Number of QoS 1 messages publish_many keeps unacknowledged at once
+DEFAULT_MAX_INFLIGHT = 20
+
+# Number of outbox messages replayed per window when draining a backlog
+OUTBOX_DRAIN_BATCH = 500
+
+# Seconds an ack of a message id nobody waits for is kept. Acks can overtake
+# the registration of their message id; acks of QoS 0 metrics and of
+# batches given up on are never claimed and expire.
+UNCLAIMED_ACK_TTL = 10
+
+# MQTT protocol versions by their export2mqtt.cfg name
+MQTT_PROTOCOLS = {
+    "3.1.1": mqtt.MQTTv311,
+    "5": mqtt.MQTTv5,
+}
+
+# Raw scale readings are worthless after a while, the broker drops them
+# after this many seconds in MQTT v5 mode instead of queueing them forever
+RAW_TOPIC_PREFIX = "health/raw/"
+RAW_MESSAGE_EXPIRY = 600
+
+def blood_pressure_category(systolic, diastolic, standard):
+    """Return the category of a blood pressure reading by omron_export_category ("eu" or "us"), "None" if unknown."""
+    category = "None"
+    if standard == 'eu':
+        if systolic < 130 and diastolic < 85:
+            category = "Normal"
+        elif (130 <= systolic <= 139 and diastolic < 85) or (systolic < 130 and 85 <= diastolic <= 89):
+            category = "High-Normal"
+        elif (140 <= systolic <= 159 and diastolic < 90) or (systolic < 140 and 90 <= diastolic <= 99):
+            category = "Grade_1"
+        elif (160 <= systolic <= 179 and diastolic < 100) or (systolic < 160 and 100 <= diastolic <= 109):
+            category = "Grade_2"
+    elif standard == 'us':
+        if systolic < 120 and diastolic < 80:
+            category = "Normal"
+        elif (120 <= systolic <= 129) and diastolic < 80:
+            category = "High-Normal"
+        elif (130 <= systolic <= 139) or (80 <= diastolic <= 89):
+            category = "Grade_1"
+        elif (systolic >= 140) or (diastolic >= 90):
+            category = "Grade_2"
+    return category
 
 class MQTTHealthDataPublisher:
-    def __init__(self, broker_host='localhost', broker_port=1883, username=None, password=None):
-        """Initialize MQTT publisher for health data."""
+    def __init__(self, broker_host='localhost', broker_port=1883, username=None, password=None, outbox_dir=None, payload_encoding='json',
+                 metrics_interval=None, protocol='3.1.1'):
+        """Initialize MQTT publisher for health data.
+        
+        With outbox_dir, QoS 1 messages are first written to an on-disk
+        outbox (see mqtt_outbox.py) and count as delivered once stored;
+        the outbox is replayed whenever a broker connection is available.
+        
+        With payload_encoding='compact', payloads are struct-packed by
+        health_codec.py and published on the topic plus "/c1"; payloads
+        that do not fit their schema are still sent as JSON.
+        
+        Latency histograms of the publishing stages are published on
+        healthdata/metrics every metrics_interval seconds and on disconnect.
+        
+        With protocol='5', the client speaks MQTT v5: the first message on a
+        topic of each connection carries the payload schema version as a
+        property, raw scale data expires on the broker and QoS 0 messages use
+        topic aliases.
+        """
+        if payload_encoding not in ('json', 'compact'):
+            raise ValueError(f"Unknown payload encoding: {payload_encoding}")
+        if protocol not in MQTT_PROTOCOLS:
+            raise ValueError(f"Unknown MQTT protocol version: {protocol}")
         self.broker_host = broker_host
         self.broker_port = broker_port
         self.username = username
         self.password = password
+        self.payload_encoding = payload_encoding
+        self.protocol = MQTT_PROTOCOLS[protocol]
+        
+        self.outbox = None
+        self._drain_lock = threading.Lock()
+        if outbox_dir:
+            try:
+                self.outbox = MQTTOutbox(outbox_dir)
+            except OSError as e:
+                print(f"MQTT * Outbox {outbox_dir} not available, publishing without it: {e}")
         
         # Use the new callback API version for paho-mqtt 2.x
         try:
-            self.client = mqtt.Client(callback_api_version=mqtt.CallbackAPIVersion.VERSION1)
+            self.client = mqtt.Client(callback_api_version=mqtt.CallbackAPIVersion.VERSION1, protocol=self.protocol)
         except AttributeError:
             # Fallback for older versions
-            self.client = mqtt.Client()
+            self.client = mqtt.Client(protocol=self.protocol)
         
         if username and password:
             self.client.username_pw_set(username, password)
@@ -26,97 +110,138 @@ class MQTTHealthDataPublisher:
         self.client.on_connect = self._on_connect
         self.client.on_publish = self._on_publish
         
-    def _on_connect(self, client, userdata, flags, rc):
+        # Set by _on_connect once the broker answers with CONNACK
+        self._connack = threading.Event()
+        self._connect_rc = None
+        
+        # MQTT v5 topic aliases of the current connection, topic -> alias.
+        # The broker announces how many it accepts in its CONNACK.
+        self._alias_lock = threading.Lock()
+        self._topic_aliases = {}
+        self._schema_topics = set()  # topics that sent the schema property on this connection
+        self._topic_alias_maximum = 0
+        
+        # Message ids a batch waits for and their acks, guarded by _ack_condition.
+        # Ids are only registered after publish() returns, since paho holds its
+        # message lock while calling _on_publish.
+        self._ack_condition = threading.Condition()
+        self._waiting_mids = {}  # mid -> time.monotonic() of the ack, None until acked
+        self._unclaimed_acks = {}  # mid -> time.monotonic() of the ack, oldest first
+        
+        self.latency = LatencyRecorder()
+        self._metrics_stop = threading.Event()
+        if metrics_interval:
+            threading.Thread(target=self._metrics_loop, args=(metrics_interval,), daemon=True).start()
+        
+    def _on_connect(self, client, userdata, flags, rc, properties=None):
         """Callback for when the client connects to the broker."""
+        # Aliases are only valid for one connection
+        self._topic_aliases = {}
+        self._schema_topics = set()
+        self._topic_alias_maximum = getattr(properties, 'TopicAliasMaximum', 0)
+        self._connect_rc = rc
+        self._connack.set()
         if rc == 0:
             print("MQTT * Connected successfully to broker")
+            if self.outbox is not None and len(self.outbox):
+                # Replay the backlog off the network thread, it waits for acks
+                threading.Thread(target=self._drain_outbox, daemon=True).start()
         else:
             print(f"MQTT * Failed to connect, return code {rc}")
     
     def _on_publish(self, client, userdata, mid):
         """Callback for when a message is published."""
         print(f"MQTT * Message {mid} published successfully")
+        now = time.monotonic()
+        with self._ack_condition:
+            if mid in self._waiting_mids:
+                self._waiting_mids[mid] = now
+            else:
+                while self._unclaimed_acks:
+                    oldest, acked_at = next(iter(self._unclaimed_acks.items()))
+                    if acked_at > now - UNCLAIMED_ACK_TTL:
+                        break
+                    del self._unclaimed_acks[oldest]
+                self._unclaimed_acks.pop(mid, None)  # keep the dict ordered by time
+                self._unclaimed_acks[mid] = now
+            self._ack_condition.notify_all()
     
-    def connect(self):
-        """Connect to MQTT broker."""
+    def connect(self, timeout=5):
+        """Connect to MQTT broker.
+        
+        Blocks only until the broker acknowledges the connection (or until
+        timeout seconds have passed), instead of sleeping a fixed interval.
+        """
         try:
+            self._connack.clear()
             self.client.connect(self.broker_host, self.broker_port, 60)
             self.client.loop_start()
-            time.sleep(1)  # Give it time to connect
-            return True
+            if not self._connack.wait(timeout):
+                print(f"MQTT * No answer from broker within {timeout}s")
+                return False
+            return self._connect_rc == 0
         except Exception as e:
             print(f"MQTT * Connection error: {e}")
+            if self.outbox is not None:
+                # Keep retrying in the background, the outbox holds messages meanwhile
+                self.client.connect_async(self.broker_host, self.broker_port, 60)
+                self.client.loop_start()
             return False
     
     def disconnect(self):
         """Disconnect from MQTT broker."""
+        self._metrics_stop.set()
+        if self.client.is_connected():
+            self.publish_metrics()
         self.client.loop_stop()
         self.client.disconnect()
+        if self.outbox is not None:
+            self.outbox.close()
     
-    def publish_body_composition(self, user_email, timestamp, data):
-        """Publish body composition data to MQTT.
-        
-        Args:
-            user_email: User identifier
-            timestamp: Unix timestamp or datetime object
-            data: Dictionary containing body composition metrics
-        """
+    @staticmethod
+    def _format_timestamp(timestamp):
+        """Return an ISO timestamp for a Unix timestamp or pass a string through."""
         if isinstance(timestamp, int):
-            timestamp_str = datetime.fromtimestamp(timestamp).isoformat()
-        else:
-            timestamp_str = timestamp
-        
-        # Prepare MQTT payload
+            return datetime.fromtimestamp(timestamp).isoformat()
+        return timestamp
+    
+    @staticmethod
+    def _user_topic(data_type, user_email):
+        """Return the topic for a user measurement, e.g. health/blood_pressure/john_at_example_com."""
+        return f"health/{data_type}/{user_email.replace('@', '_at_').replace('.', '_')}"
+    
+    def _trace(self, timestamp, read_at):
+        """Return the trace of a payload and record how old the reading was when it was read."""
+        trace = {}
+        if read_at is not None:
+            trace["read"] = read_at
+            if isinstance(timestamp, (int, float)):
+                self.latency.observe("capture", read_at - timestamp)
+        return trace
+    
+    def _body_composition_message(self, user_email, timestamp, data, read_at=None):
+        """Build (topic, payload, qos, retain) for a body composition measurement."""
         payload = {
             "user": user_email,
-            "timestamp": timestamp_str,
+            "timestamp": self._format_timestamp(timestamp),
             "type": "body_composition",
-            "data": data
+            "data": data,
+            "trace": self._trace(timestamp, read_at)
         }
-        
-        # Publish to topic: health/body_composition/{user_email}
-        topic = f"health/body_composition/{user_email.replace('@', '_at_').replace('.', '_')}"
-        
-        try:
-            result = self.client.publish(topic, json.dumps(payload), qos=1, retain=True)
-            if result.rc == mqtt.MQTT_ERR_SUCCESS:
-                print(f"MQTT * Published body composition data to {topic}")
-                return True
-            else:
-                print(f"MQTT * Failed to publish to {topic}, error code: {result.rc}")
-                return False
-        except Exception as e:
-            print(f"MQTT * Publish error: {e}")
-            return False
+        return self._user_topic("body_composition", user_email), payload, 1, True
     
-    def publish_blood_pressure(self, user_email, timestamp, systolic, diastolic, pulse, category=None, mov=None, ihb=None):
-        """Publish blood pressure data to MQTT.
-        
-        Args:
-            user_email: User identifier
-            timestamp: Unix timestamp or datetime object
-            systolic: Systolic blood pressure
-            diastolic: Diastolic blood pressure
-            pulse: Heart rate
-            category: Blood pressure category (optional)
-            mov: Movement detection (optional)
-            ihb: Irregular heartbeat detection (optional)
-        """
-        if isinstance(timestamp, int):
-            timestamp_str = datetime.fromtimestamp(timestamp).isoformat()
-        else:
-            timestamp_str = timestamp
-        
-        # Prepare MQTT payload
+    def _blood_pressure_message(self, user_email, timestamp, systolic, diastolic, pulse, category=None, mov=None, ihb=None, read_at=None):
+        """Build (topic, payload, qos, retain) for a blood pressure measurement."""
         payload = {
             "user": user_email,
-            "timestamp": timestamp_str,
+            "timestamp": self._format_timestamp(timestamp),
             "type": "blood_pressure",
             "data": {
                 "systolic": systolic,
                 "diastolic": diastolic,
                 "pulse": pulse
-            }
+            },
+            "trace": self._trace(timestamp, read_at)
         }
         
         # Add optional fields if provided
@@ -127,33 +252,10 @@ class MQTTHealthDataPublisher:
         if ihb is not None:
             payload["data"]["irregular_heartbeat"] = bool(ihb)
         
-        # Publish to topic: health/blood_pressure/{user_email}
-        topic = f"health/blood_pressure/{user_email.replace('@', '_at_').replace('.', '_')}"
-        
-        try:
-            result = self.client.publish(topic, json.dumps(payload), qos=1, retain=True)
-            if result.rc == mqtt.MQTT_ERR_SUCCESS:
-                print(f"MQTT * Published blood pressure data to {topic}")
-                return True
-            else:
-                print(f"MQTT * Failed to publish to {topic}, error code: {result.rc}")
-                return False
-        except Exception as e:
-            print(f"MQTT * Publish error: {e}")
-            return False
+        return self._user_topic("blood_pressure", user_email), payload, 1, True
     
-    def publish_raw_scale_data(self, device_mac, timestamp, weight, impedance, battery_v=None, battery_percent=None):
-        """Publish raw scale data to MQTT (for debugging/monitoring).
-        
-        Args:
-            device_mac: Device MAC address
-            timestamp: Unix timestamp
-            weight: Weight in kg
-            impedance: Impedance value
-            battery_v: Battery voltage (optional)
-            battery_percent: Battery percentage (optional)
-        """
-        # Prepare MQTT payload
+    def _raw_scale_message(self, device_mac, timestamp, weight, impedance, battery_v=None, battery_percent=None, read_at=None):
+        """Build (topic, payload, qos, retain) for a raw scale reading."""
         payload = {
             "device": device_mac,
             "timestamp": datetime.fromtimestamp(timestamp).isoformat(),
@@ -161,7 +263,8 @@ class MQTTHealthDataPublisher:
             "data": {
                 "weight": weight,
                 "impedance": impedance
-            }
+            },
+            "trace": self._trace(timestamp, read_at)
         }
         
         # Add battery info if available
@@ -171,16 +274,290 @@ class MQTTHealthDataPublisher:
             payload["data"]["battery_percent"] = battery_percent
         
         # Publish to topic: health/raw/{device_mac}
-        topic = f"health/raw/{device_mac.replace(':', '')}"
+        return f"{RAW_TOPIC_PREFIX}{device_mac.replace(':', '')}", payload, 0, False
+    
+    # Message builders by measurement type, used by publish_many
+    MESSAGE_BUILDERS = {
+        "body_composition": _body_composition_message,
+        "blood_pressure": _blood_pressure_message,
+        "raw_scale_data": _raw_scale_message,
+    }
+    
+    def _build_message(self, measurement):
+        """Build (topic, payload, qos, retain) for a publish_many measurement dict."""
+        kwargs = dict(measurement)
+        builder = self.MESSAGE_BUILDERS[kwargs.pop("type")]
+        return builder(self, **kwargs)
+    
+    def _encode_message(self, message):
+        """Serialize the payload of a (topic, payload, qos, retain) tuple for the wire."""
+        topic, payload, qos, retain = message
+        trace = payload.get("trace")
+        if trace is not None:
+            trace["sent"] = time.time()
+            if "read" in trace:
+                self.latency.observe("export", trace["sent"] - trace["read"])
+        if self.payload_encoding == 'compact':
+            encoded = health_codec.encode_compact(payload)
+            if encoded is not None:
+                return topic + health_codec.COMPACT_TOPIC_SUFFIX, encoded, qos, retain
+        return topic, json.dumps(payload).encode('utf-8'), qos, retain
+    
+    def _alias_topic(self, topic, properties):
+        """Return the topic to send in an MQTT v5 PUBLISH and set its TopicAlias.
         
-        try:
-            result = self.client.publish(topic, json.dumps(payload), qos=0)
-            if result.rc == mqtt.MQTT_ERR_SUCCESS:
-                print(f"MQTT * Published raw scale data to {topic}")
-                return True
+        The first message on a topic registers an alias, later ones send an
+        empty topic. Only used for QoS 0: paho resends unacknowledged QoS 1
+        messages verbatim after a reconnect, when the broker has forgotten
+        the aliases of the previous connection. Called with _alias_lock held.
+        """
+        alias = self._topic_aliases.get(topic)
+        if alias is not None:
+            properties.TopicAlias = alias
+            return ""
+        if len(self._topic_aliases) < self._topic_alias_maximum:
+            alias = len(self._topic_aliases) + 1
+            self._topic_aliases[topic] = alias
+            properties.TopicAlias = alias
+        return topic
+    
+    def _publish(self, topic, payload, qos, retain):
+        """Hand one encoded message to paho, adding the MQTT v5 properties in v5 mode."""
+        if self.protocol != mqtt.MQTTv5:
+            return self.client.publish(topic, payload, qos=qos, retain=retain)
+        properties = Properties(PacketTypes.PUBLISH)
+        # No ContentType: the listener tells compact from JSON by the magic
+        # byte. The schema version only changes with a new publisher, which
+        # reconnects, so it is sent once per topic and connection.
+        if topic not in self._schema_topics:
+            self._schema_topics.add(topic)
+            properties.UserProperty = ("schema", str(health_codec.PAYLOAD_SCHEMA_VERSION))
+        if topic.startswith(RAW_TOPIC_PREFIX):
+            properties.MessageExpiryInterval = RAW_MESSAGE_EXPIRY
+        if qos == 0:
+            # Keep the alias registration and its first use in order on the wire
+            with self._alias_lock:
+                return self.client.publish(self._alias_topic(topic, properties), payload, qos=qos, retain=retain, properties=properties)
+        return self.client.publish(topic, payload, qos=qos, retain=retain, properties=properties)
+    
+    def _send_messages(self, messages, max_inflight=DEFAULT_MAX_INFLIGHT, timeout=30):
+        """Publish encoded (topic, payload, qos, retain) tuples with a bounded in-flight window.
+        
+        Returns one bool per message, True once the broker has acknowledged
+        it (QoS 1) or it has been written to the socket (QoS 0). None entries
+        are skipped and reported as failed. Gives up on the remaining
+        messages if the broker makes no progress for timeout seconds.
+        """
+        results = []
+        inflight = {}  # mid -> result index
+        sent_at = {}  # mid -> time.monotonic() of the publish call
+        
+        def reap():
+            for mid in list(inflight):
+                acked_at = self._waiting_mids.get(mid)
+                if acked_at is not None:
+                    del self._waiting_mids[mid]
+                    self.latency.observe("ack", acked_at - sent_at.pop(mid))
+                    results[inflight.pop(mid)] = True
+        
+        def wait_for_window(size):
+            # Block until fewer than size messages are waiting for an ack
+            with self._ack_condition:
+                reap()
+                while len(inflight) >= size:
+                    if not self._ack_condition.wait(timeout):
+                        # Broker stopped acknowledging, forget the rest of the window
+                        for mid in inflight:
+                            del self._waiting_mids[mid]
+                        inflight.clear()
+                        return False
+                    reap()
+            return True
+        
+        stalled = False
+        for message in messages:
+            results.append(False)
+            if stalled or message is None:
+                continue
+            topic, payload, qos, retain = message
+            started = time.monotonic()
+            try:
+                info = self._publish(topic, payload, qos, retain)
+            except Exception as e:
+                print(f"MQTT * Publish error: {e}")
+                continue
+            # QoS 1 messages without a connection are queued by paho and sent on reconnect
+            if info.rc == mqtt.MQTT_ERR_SUCCESS or (qos > 0 and info.rc == mqtt.MQTT_ERR_NO_CONN):
+                with self._ack_condition:
+                    # An ack from before this publish belongs to an earlier message with the same id
+                    acked_at = self._unclaimed_acks.pop(info.mid, None)
+                    self._waiting_mids[info.mid] = acked_at if acked_at is not None and acked_at >= started else None
+                inflight[info.mid] = len(results) - 1
+                sent_at[info.mid] = started
             else:
-                print(f"MQTT * Failed to publish to {topic}, error code: {result.rc}")
-                return False
+                print(f"MQTT * Failed to publish to {topic}, error code: {info.rc}")
+                continue
+            if not wait_for_window(max_inflight):
+                stalled = True
+        
+        if not stalled:
+            wait_for_window(1)
+        return results
+    
+    def _drain_outbox(self, max_inflight=DEFAULT_MAX_INFLIGHT, timeout=30):
+        """Replay unacknowledged outbox messages in order while the broker is connected."""
+        with self._drain_lock:
+            while self.client.is_connected():
+                backlog = self.outbox.pending(OUTBOX_DRAIN_BATCH)
+                if not backlog:
+                    break
+                results = self._send_messages([message[1:] for message in backlog], max_inflight, timeout)
+                for (seq, *message), acked in zip(backlog, results):
+                    if acked:
+                        self.outbox.ack(seq)
+                self.outbox.flush_acks()
+                if not all(results):
+                    break
+            if len(self.outbox):
+                print(f"MQTT * {len(self.outbox)} messages waiting in outbox")
+    
+    def _deliver(self, messages, max_inflight=DEFAULT_MAX_INFLIGHT, timeout=30):
+        """Send built messages, through the outbox when there is one.
+        
+        Returns one bool per message. With an outbox, QoS 1 messages count as
+        delivered once they are stored on disk; they are sent right away if
+        the broker is connected and otherwise on the next connect.
+        """
+        encoded = [None if message is None else self._encode_message(message) for message in messages]
+        if self.outbox is None:
+            return self._send_messages(encoded, max_inflight, timeout)
+        
+        results = [False] * len(encoded)
+        direct = []
+        for index, message in enumerate(encoded):
+            if message is None:
+                continue
+            if message[2] > 0:
+                self.outbox.append(*message)
+                results[index] = True
+            else:
+                direct.append(index)
+        self.outbox.sync()
+        
+        # QoS 0 data is not worth keeping, send it straight away
+        for index, sent in zip(direct, self._send_messages([encoded[index] for index in direct], max_inflight, timeout)):
+            results[index] = sent
+        self._drain_outbox(max_inflight, timeout)
+        return results
+    
+    def publish_many(self, measurements, max_inflight=DEFAULT_MAX_INFLIGHT, timeout=30):
+        """Publish many measurements, pipelined, and report which were acknowledged.
+        
+        Args:
+            measurements: Iterable of dicts with a "type" key ("body_composition",
+                "blood_pressure" or "raw_scale_data") and the keyword arguments of
+                the matching publish_* method
+            max_inflight: Maximum number of messages waiting for a PUBACK at once
+            timeout: Seconds to wait for the broker to acknowledge progress
+        
+        Returns:
+            List of bools in input order, True for each acknowledged measurement
+            (or, with an outbox, each measurement stored in the outbox)
+        """
+        # Let paho put the whole window on the wire instead of queueing behind its own limit
+        self.client.max_inflight_messages_set(max(max_inflight, DEFAULT_MAX_INFLIGHT))
+        
+        messages = []
+        for index, measurement in enumerate(measurements):
+            try:
+                messages.append(self._build_message(measurement))
+            except (KeyError, TypeError, ValueError) as e:
+                print(f"MQTT * Invalid measurement {index}: {e}")
+                messages.append(None)
+        
+        results = self._deliver(messages, max_inflight, timeout)
+        print(f"MQTT * Batch published, {sum(results)}/{len(results)} delivered")
+        return results
+    
+    def _publish_message(self, message, description):
+        """Publish one message and wait for the broker to acknowledge it."""
+        topic = message[0]
+        if self._deliver([message], timeout=10)[0]:
+            print(f"MQTT * Published {description} to {topic}")
+            return True
+        print(f"MQTT * Failed to publish to {topic}, not acknowledged by broker")
+        return False
+    
+    def publish_body_composition(self, user_email, timestamp, data, read_at=None):
+        """Publish body composition data to MQTT.
+        
+        Args:
+            user_email: User identifier
+            timestamp: Unix timestamp or datetime object
+            data: Dictionary containing body composition metrics
+            read_at: Unix time the reading was read from the device (optional, for latency tracing)
+        """
+        # Publish to topic: health/body_composition/{user_email}
+        message = self._body_composition_message(user_email, timestamp, data, read_at)
+        return self._publish_message(message, "body composition data")
+    
+    def publish_blood_pressure(self, user_email, timestamp, systolic, diastolic, pulse, category=None, mov=None, ihb=None, read_at=None):
+        """Publish blood pressure data to MQTT.
+        
+        Args:
+            user_email: User identifier
+            timestamp: Unix timestamp or datetime object
+            systolic: Systolic blood pressure
+            diastolic: Diastolic blood pressure
+            pulse: Heart rate
+            category: Blood pressure category (optional)
+            mov: Movement detection (optional)
+            ihb: Irregular heartbeat detection (optional)
+            read_at: Unix time the reading was read from the device (optional, for latency tracing)
+        """
+        # Publish to topic: health/blood_pressure/{user_email}
+        message = self._blood_pressure_message(user_email, timestamp, systolic, diastolic, pulse, category, mov, ihb, read_at)
+        return self._publish_message(message, "blood pressure data")
+    
+    def publish_raw_scale_data(self, device_mac, timestamp, weight, impedance, battery_v=None, battery_percent=None, read_at=None):
+        """Publish raw scale data to MQTT (for debugging/monitoring).
+        
+        Args:
+            device_mac: Device MAC address
+            timestamp: Unix timestamp
+            weight: Weight in kg
+            impedance: Impedance value
+            battery_v: Battery voltage (optional)
+            battery_percent: Battery percentage (optional)
+            read_at: Unix time the reading was read from the device (optional, for latency tracing)
+        """
+        message = self._raw_scale_message(device_mac, timestamp, weight, impedance, battery_v, battery_percent, read_at)
+        return self._publish_message(message, "raw scale data")
+    
+    def publish_metrics(self):
+        """Publish the latency histograms recorded since the last call to healthdata/metrics.
+        
+        Stages: capture (measurement to read from the device), export (read
+        to handed to MQTT) and ack (publish to PUBACK). The listener merges
+        the histograms of all publishers.
+        """
+        stages = self.latency.take()
+        if not stages:
+            return False
+        payload = {
+            "source": f"publisher@{socket.gethostname()}",
+            "timestamp": datetime.now().isoformat(),
+            "stages": stages
+        }
+        try:
+            info = self._publish(METRICS_TOPIC, json.dumps(payload).encode('utf-8'), 0, False)
         except Exception as e:
-            print(f"MQTT * Publish error: {e}")
-            return False
\ No newline at end of file
+            print(f"MQTT * Metrics publish error: {e}")
+            return False
+        return info.rc == mqtt.MQTT_ERR_SUCCESS
+    
+    def _metrics_loop(self, interval):
+        """Publish latency histograms every interval seconds until disconnect."""
+        while not self._metrics_stop.wait(interval):
+            if self.client.is_connected():
+                self.publish_metrics()
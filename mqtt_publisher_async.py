@@ -0,0 +1,163 @@
+#!/usr/bin/python3
+
+import asyncio
+import paho.mqtt.client as mqtt
+from mqtt_publisher import MQTTHealthDataPublisher, DEFAULT_MAX_INFLIGHT
+
+class AsyncMQTTHealthDataPublisher(MQTTHealthDataPublisher):
+    """MQTT publisher driven by the running asyncio event loop.
+
+    Instead of paho's network thread (loop_start), the client socket is
+    registered with the event loop, so publishing can overlap with other
+    coroutines such as an ongoing BLE readout in omblepy.py. Message
+    building is shared with MQTTHealthDataPublisher; connect, disconnect,
+    publish_many and the inherited publish_* methods must be awaited.
+    """
+
+    def __init__(self, broker_host='localhost', broker_port=1883, username=None, password=None, payload_encoding='json',
+                 protocol='3.1.1'):
+        """Initialize asyncio MQTT publisher for health data."""
+        super().__init__(broker_host, broker_port, username, password, payload_encoding=payload_encoding, protocol=protocol)
+        self.loop = None
+        self._misc_task = None
+        self._connack_future = None
+        self._ack_futures = {}  # mid -> future resolved by _on_publish
+        self._early_acks = set()  # acks that arrived before their future was created
+
+        self.client.on_socket_open = self._on_socket_open
+        self.client.on_socket_close = self._on_socket_close
+        self.client.on_socket_register_write = self._on_socket_register_write
+        self.client.on_socket_unregister_write = self._on_socket_unregister_write
+
+    def _on_socket_open(self, client, userdata, sock):
+        """Start reading from the broker socket on the event loop."""
+        self.loop.add_reader(sock, client.loop_read)
+        self._misc_task = self.loop.create_task(self._misc_loop())
+
+    def _on_socket_close(self, client, userdata, sock):
+        """Stop watching the broker socket."""
+        self.loop.remove_reader(sock)
+        if self._misc_task is not None:
+            self._misc_task.cancel()
+            self._misc_task = None
+
+    def _on_socket_register_write(self, client, userdata, sock):
+        """Flush outgoing packets when the socket becomes writable."""
+        self.loop.add_writer(sock, client.loop_write)
+
+    def _on_socket_unregister_write(self, client, userdata, sock):
+        """Nothing left to write, stop watching for writability."""
+        self.loop.remove_writer(sock)
+
+    async def _misc_loop(self):
+        """Run paho's housekeeping (keepalive pings, retries) once per second."""
+        while self.client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+            try:
+                await asyncio.sleep(1)
+            except asyncio.CancelledError:
+                break
+
+    def _on_connect(self, client, userdata, flags, rc, properties=None):
+        """Callback for when the client connects to the broker."""
+        super()._on_connect(client, userdata, flags, rc, properties)
+        if self._connack_future is not None and not self._connack_future.done():
+            self._connack_future.set_result(rc)
+
+    def _on_publish(self, client, userdata, mid):
+        """Callback for when a message is published."""
+        print(f"MQTT * Message {mid} published successfully")
+        future = self._ack_futures.pop(mid, None)
+        if future is None:
+            self._early_acks.add(mid)
+        elif not future.done():
+            future.set_result(True)
+
+    async def connect(self, timeout=5):
+        """Connect to MQTT broker and wait for the CONNACK."""
+        self.loop = asyncio.get_running_loop()
+        self._connack_future = self.loop.create_future()
+        try:
+            self.client.connect(self.broker_host, self.broker_port, 60)
+            rc = await asyncio.wait_for(self._connack_future, timeout)
+            return rc == 0
+        except asyncio.TimeoutError:
+            print(f"MQTT * No answer from broker within {timeout}s")
+            return False
+        except Exception as e:
+            print(f"MQTT * Connection error: {e}")
+            return False
+
+    async def disconnect(self):
+        """Disconnect from MQTT broker, publishing the latency histograms first."""
+        if self.client.is_connected():
+            self.publish_metrics()
+        self.client.disconnect()
+        # Let the event loop flush the DISCONNECT packet
+        await asyncio.sleep(0)
+
+    async def _send_message(self, message, timeout):
+        """Publish one (topic, payload, qos, retain) tuple and wait for its ack."""
+        topic, payload, qos, retain = self._encode_message(message)
+        started = self.loop.time()
+        try:
+            info = self._publish(topic, payload, qos, retain)
+        except Exception as e:
+            print(f"MQTT * Publish error: {e}")
+            return False
+        if info.rc != mqtt.MQTT_ERR_SUCCESS and not (qos > 0 and info.rc == mqtt.MQTT_ERR_NO_CONN):
+            print(f"MQTT * Failed to publish to {topic}, error code: {info.rc}")
+            return False
+        if info.mid in self._early_acks:
+            self._early_acks.discard(info.mid)
+            self.latency.observe("ack", self.loop.time() - started)
+            return True
+        future = self.loop.create_future()
+        self._ack_futures[info.mid] = future
+        try:
+            acked = await asyncio.wait_for(future, timeout)
+            self.latency.observe("ack", self.loop.time() - started)
+            return acked
+        except asyncio.TimeoutError:
+            self._ack_futures.pop(info.mid, None)
+            return False
+
+    async def _send_messages(self, messages, max_inflight=DEFAULT_MAX_INFLIGHT, timeout=30):
+        """Publish messages with at most max_inflight waiting for an ack, one bool per message."""
+        window = asyncio.Semaphore(max_inflight)
+
+        async def send(message):
+            if message is None:
+                return False
+            async with window:
+                return await self._send_message(message, timeout)
+
+        return list(await asyncio.gather(*(send(message) for message in messages)))
+
+    async def publish_many(self, measurements, max_inflight=DEFAULT_MAX_INFLIGHT, timeout=30):
+        """Publish many measurements, pipelined, and report which were acknowledged.
+
+        Same measurement format and result as MQTTHealthDataPublisher.publish_many.
+        """
+        self.client.max_inflight_messages_set(max(max_inflight, DEFAULT_MAX_INFLIGHT))
+
+        # Build every message before the first await
+        messages = []
+        for index, measurement in enumerate(measurements):
+            try:
+                messages.append(self._build_message(measurement))
+            except (KeyError, TypeError, ValueError) as e:
+                print(f"MQTT * Invalid measurement {index}: {e}")
+                messages.append(None)
+
+        results = await self._send_messages(messages, max_inflight, timeout)
+        print(f"MQTT * Batch published, {sum(results)}/{len(results)} delivered")
+        return results
+
+    async def _publish_message(self, message, description):
+        """Publish one message and wait for the broker to acknowledge it."""
+        topic = message[0]
+        if await self._send_message(message, timeout=10):
+            print(f"MQTT * Published {description} to {topic}")
+            return True
+        print(f"MQTT * Failed to publish to {topic}, not acknowledged by broker")
+        return False
@@ -0,0 +1,252 @@
+#!/usr/bin/python3
+
+import os
+import json
+import time
+import socket
+import socketserver
+from mqtt_publisher import MQTTHealthDataPublisher, DEFAULT_MAX_INFLIGHT
+
+# Default location of the local socket, next to temp.log on tmpfs
+DEFAULT_SOCKET = '/dev/shm/healthdata2mqtt.sock'
+
+# Default outbox directory, relative to the project root; an empty mqtt_outbox_dir disables the outbox
+DEFAULT_OUTBOX_DIR = 'user/mqtt_outbox'
+
+# Publisher methods that clients are allowed to call through the socket
+DAEMON_METHODS = (
+    'publish_body_composition',
+    'publish_blood_pressure',
+    'publish_raw_scale_data',
+    'publish_many',
+)
+
+
+def read_mqtt_config(cfg_file):
+    """Read MQTT broker and daemon settings from export2mqtt.cfg."""
+    mqtt_config = {'host': 'localhost', 'port': 1883, 'username': None, 'password': None,
+                   'daemon_socket': DEFAULT_SOCKET, 'outbox_dir': DEFAULT_OUTBOX_DIR, 'payload_encoding': 'json',
+                   'metrics_interval': 60, 'protocol': '3.1.1'}
+    with open(cfg_file, 'r') as file:
+        for line in file:
+            line = line.strip()
+            if line.startswith('mqtt_host='):
+                mqtt_config['host'] = line.split('=')[1].strip()
+            elif line.startswith('mqtt_port='):
+                mqtt_config['port'] = int(line.split('=')[1].strip())
+            elif line.startswith('mqtt_username='):
+                username = line.split('=')[1].strip()
+                mqtt_config['username'] = username if username else None
+            elif line.startswith('mqtt_password='):
+                password = line.split('=')[1].strip()
+                mqtt_config['password'] = password if password else None
+            elif line.startswith('mqtt_daemon_socket='):
+                mqtt_config['daemon_socket'] = line.split('=')[1].strip()
+            elif line.startswith('mqtt_outbox_dir='):
+                outbox_dir = line.split('=')[1].strip()
+                mqtt_config['outbox_dir'] = outbox_dir if outbox_dir else None
+            elif line.startswith('mqtt_payload_encoding='):
+                payload_encoding = line.split('=')[1].strip()
+                mqtt_config['payload_encoding'] = payload_encoding if payload_encoding else 'json'
+            elif line.startswith('mqtt_metrics_interval='):
+                metrics_interval = line.split('=')[1].strip()
+                mqtt_config['metrics_interval'] = int(metrics_interval) if metrics_interval else None
+            elif line.startswith('mqtt_protocol='):
+                protocol = line.split('=')[1].strip()
+                mqtt_config['protocol'] = protocol if protocol else '3.1.1'
+    return mqtt_config
+
+
+def outbox_path(mqtt_config):
+    """Return the configured outbox directory, relative paths are resolved against the project root."""
+    outbox_dir = mqtt_config.get('outbox_dir')
+    if not outbox_dir:
+        return None
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), outbox_dir)
+
+
+class MQTTPublisherDaemonClient:
+    """Drop-in replacement for MQTTHealthDataPublisher that hands records to
+    a running mqtt_publisher_daemon.py over its local socket.
+
+    The daemon owns the broker session, so a client only pays for a local
+    socket round trip per record instead of a full MQTT connect.
+    """
+
+    def __init__(self, socket_path=DEFAULT_SOCKET, timeout=10):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.sock = None
+        self.reader = None
+
+    def connect(self):
+        """Connect to the publisher daemon."""
+        try:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.settimeout(self.timeout)
+            self.sock.connect(self.socket_path)
+            self.reader = self.sock.makefile('r', encoding='utf-8')
+            return True
+        except OSError as e:
+            print(f"MQTT * Publisher daemon not reachable at {self.socket_path}: {e}")
+            self.disconnect()
+            return False
+
+    def disconnect(self):
+        """Close the connection to the publisher daemon."""
+        if self.reader is not None:
+            self.reader.close()
+            self.reader = None
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def _call(self, method, **kwargs):
+        """Send one request to the daemon and return its result, False on error."""
+        try:
+            request = json.dumps({'method': method, 'kwargs': kwargs}) + '\n'
+            self.sock.sendall(request.encode('utf-8'))
+            response = json.loads(self.reader.readline())
+        except (OSError, ValueError) as e:
+            print(f"MQTT * Publisher daemon error: {e}")
+            return False
+        if response.get('error'):
+            print(f"MQTT * Publisher daemon error: {response['error']}")
+        return response.get('ok')
+
+    def publish_body_composition(self, user_email, timestamp, data, read_at=None):
+        """Publish body composition data through the daemon."""
+        return bool(self._call('publish_body_composition', user_email=user_email, timestamp=timestamp, data=data,
+                               read_at=read_at))
+
+    def publish_blood_pressure(self, user_email, timestamp, systolic, diastolic, pulse, category=None, mov=None, ihb=None, read_at=None):
+        """Publish blood pressure data through the daemon."""
+        return bool(self._call('publish_blood_pressure', user_email=user_email, timestamp=timestamp,
+                               systolic=systolic, diastolic=diastolic, pulse=pulse,
+                               category=category, mov=mov, ihb=ihb, read_at=read_at))
+
+    def publish_raw_scale_data(self, device_mac, timestamp, weight, impedance, battery_v=None, battery_percent=None, read_at=None):
+        """Publish raw scale data through the daemon."""
+        return bool(self._call('publish_raw_scale_data', device_mac=device_mac, timestamp=timestamp,
+                               weight=weight, impedance=impedance,
+                               battery_v=battery_v, battery_percent=battery_percent, read_at=read_at))
+
+    def publish_many(self, measurements, max_inflight=DEFAULT_MAX_INFLIGHT, timeout=30):
+        """Publish many measurements through the daemon, one ack status per measurement."""
+        measurements = list(measurements)
+        results = self._call('publish_many', measurements=measurements, max_inflight=max_inflight, timeout=timeout)
+        if not isinstance(results, list):
+            return [False] * len(measurements)
+        return results
+
+
+def open_publisher(mqtt_config):
+    """Return a connected publisher, preferring the daemon when it is running.
+
+    Falls back to a direct broker connection so exporters keep working when
+    the daemon is not started. With an outbox configured, the direct
+    publisher is returned even while the broker is down and keeps the
+    records on disk. Returns None if nothing can take the records.
+    """
+    socket_path = mqtt_config.get('daemon_socket')
+    if socket_path and os.path.exists(socket_path):
+        publisher = MQTTPublisherDaemonClient(socket_path)
+        if publisher.connect():
+            return publisher
+
+    publisher = MQTTHealthDataPublisher(
+        broker_host=mqtt_config['host'],
+        broker_port=mqtt_config['port'],
+        username=mqtt_config['username'],
+        password=mqtt_config['password'],
+        outbox_dir=outbox_path(mqtt_config),
+        payload_encoding=mqtt_config.get('payload_encoding', 'json'),
+        protocol=mqtt_config.get('protocol', '3.1.1')
+    )
+    if publisher.connect() or publisher.outbox is not None:
+        return publisher
+    publisher.disconnect()
+    return None
+
+
+class _DaemonRequestHandler(socketserver.StreamRequestHandler):
+    """Handle newline-delimited JSON requests from one local client."""
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                method = request.get('method')
+                if method not in DAEMON_METHODS:
+                    response = {'ok': False, 'error': f"unknown method {method}"}
+                else:
+                    result = getattr(self.server.publisher, method)(**request.get('kwargs', {}))
+                    response = {'ok': result if isinstance(result, list) else bool(result)}
+            except Exception as e:
+                response = {'ok': False, 'error': str(e)}
+            self.wfile.write((json.dumps(response) + '\n').encode('utf-8'))
+
+
+class MQTTPublisherDaemon(socketserver.ThreadingUnixStreamServer):
+    """Local socket server that keeps one MQTT session open for all exporters."""
+
+    daemon_threads = True
+
+    def __init__(self, socket_path, publisher):
+        self.publisher = publisher
+        # Remove a stale socket left behind by a previous run
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        super().__init__(socket_path, _DaemonRequestHandler)
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+
+
+def main():
+    # Version info
+    print("""
+=====================================================
+Export 2 MQTT v1.0 (mqtt_publisher_daemon.py)
+=====================================================
+""")
+
+    path = os.path.dirname(os.path.abspath(__file__))
+    mqtt_config = read_mqtt_config(path + '/user/export2mqtt.cfg')
+    socket_path = mqtt_config['daemon_socket'] or DEFAULT_SOCKET
+
+    publisher = MQTTHealthDataPublisher(
+        broker_host=mqtt_config['host'],
+        broker_port=mqtt_config['port'],
+        username=mqtt_config['username'],
+        password=mqtt_config['password'],
+        outbox_dir=outbox_path(mqtt_config),
+        payload_encoding=mqtt_config.get('payload_encoding', 'json'),
+        metrics_interval=mqtt_config['metrics_interval'],
+        protocol=mqtt_config['protocol']
+    )
+
+    # Keep trying until the broker is up, paho reconnects on its own afterwards.
+    # With an outbox, records are accepted right away and sent once connected.
+    while not publisher.connect() and publisher.outbox is None:
+        print("MQTT * Broker not available, retrying in 10s")
+        # Only stop paho's loop, disconnect() would also end the metrics thread for good
+        publisher.client.loop_stop()
+        time.sleep(10)
+
+    server = MQTTPublisherDaemon(socket_path, publisher)
+    print(f"MQTT * Publisher daemon listening on {socket_path}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        publisher.disconnect()
+        print("MQTT * Publisher daemon stopped")
+
+
+if __name__ == "__main__":
+    main()
@@ -273,7 +273,8 @@ def readCsv(filename):
             oldRecordDict["datetime"] = datetime.datetime.strptime(oldRecordDict["datetime"], "%d.%m.%Y %H:%M")
             records.append(oldRecordDict)
     return records
-def appendCsv(allRecords):
+def appendCsv(allRecords, uploadedRecords = dict()):
+    #uploadedRecords: {userIdx: datetimes of the records the MQTT broker acknowledged}, written as uploaded so they are not exported again
     for userIdx in range(len(allRecords)):
         oldCsvFile = pathlib.Path(f"{switch_temp_path}/omron_user{userIdx+1}.csv")
         datesOfNewRecords = [record["datetime"] for record in allRecords[userIdx]]
@@ -286,12 +287,61 @@ def appendCsv(allRecords):
             writer = csv.DictWriter(outfile, delimiter=';', fieldnames = ["Data Status", "Unix Time", "datetime", "sys", "dia", "bpm", "mov", "ihb", "User"])
             writer.writeheader()
             for recordDict in allRecords[userIdx]:
-                recordDict["Data Status"] = "to_import"
+                if(recordDict["datetime"] in uploadedRecords.get(userIdx, ())):
+                    recordDict["Data Status"] = "uploaded"
+                elif(recordDict.get("Data Status") != "uploaded"):
+                    recordDict["Data Status"] = "to_import"
                 recordDict["Unix Time"] = int(time.mktime(recordDict["datetime"].timetuple()))
                 recordDict["datetime"] = recordDict["datetime"].strftime("%d.%m.%Y %H:%M")
                 recordDict["User"] = (f"user{userIdx+1}")
                 writer.writerow(recordDict)
 
+# Code change for Export2MQTT
+async def startMqttPublishing(publishTasks):
+    #publish the records of each user while the ring buffer of the next user is still being read
+    sys.path.insert(0, path)
+    from mqtt_publisher import blood_pressure_category
+    from mqtt_publisher_daemon import read_mqtt_config
+    from mqtt_publisher_async import AsyncMQTTHealthDataPublisher
+    mqttConfig = read_mqtt_config(path + '/user/export2mqtt.cfg')
+    userEmails = dict()
+    categoryStandard = None
+    with open(path + '/user/export2mqtt.cfg', 'r') as file:
+        for line in file:
+            line = line.strip()
+            if line.startswith('omron_export_user'):
+                name, value = line.split('=')
+                userEmails[int(name.strip()[len('omron_export_user'):]) - 1] = value.strip()
+            elif line.startswith('omron_export_category'):
+                categoryStandard = line.split('=')[1].strip()
+    mqttPublisher = AsyncMQTTHealthDataPublisher(mqttConfig['host'], mqttConfig['port'], mqttConfig['username'], mqttConfig['password'],
+                                                 payload_encoding = mqttConfig['payload_encoding'], protocol = mqttConfig['protocol'])
+    if(not await mqttPublisher.connect()):
+        #the records still end up in the csv files, omron_export_mqtt.py publishes them later
+        logger.warning(f"could not connect to MQTT broker {mqttConfig['host']}:{mqttConfig['port']}, continuing readout without publishing")
+        await mqttPublisher.disconnect()
+        return None, None
+    def onUserRecords(userIdx, records):
+        userEmail = userEmails.get(userIdx)
+        if(not userEmail or "email@email.com" in userEmail):
+            logger.warning(f"no email for user{userIdx+1} in export2mqtt.cfg, not publishing its records")
+            return
+        #build measurements now, appendCsv rewrites the record dicts later
+        readAt = time.time()
+        measurements = [{"type": "blood_pressure", "user_email": userEmail, "read_at": readAt,
+                         "timestamp": int(time.mktime(record["datetime"].timetuple())),
+                         "systolic": record["sys"], "diastolic": record["dia"], "pulse": record["bpm"],
+                         "category": blood_pressure_category(record["sys"], record["dia"], categoryStandard),
+                         "mov": record.get("mov"), "ihb": record.get("ihb")} for record in records]
+        recordTimes = [record["datetime"] for record in records]
+        logger.info(f"publishing {len(measurements)} records of user{userIdx+1} to MQTT")
+        publishTasks.append(asyncio.create_task(publishUserRecords(userIdx, recordTimes, measurements)))
+    async def publishUserRecords(userIdx, recordTimes, measurements):
+        results = await mqttPublisher.publish_many(measurements)
+        logger.info(f"MQTT acknowledged {sum(results)} of {len(results)} records of user{userIdx+1}")
+        return userIdx, {recordTime for recordTime, acknowledged in zip(recordTimes, results) if acknowledged}
+    return mqttPublisher, onUserRecords
+
 # Code change for Export2Garmin
 async def selectBLEdevices(adapter):
     print("Select your Omron device from the list below...")
@@ -321,6 +371,9 @@ async def main():
 
     # Code change for Export2Garmin
     parser.add_argument('-a', "--adapter", required="true", type=str,       help="Choose which HCI adapter you want to scan with (e.g. hci0).")
+
+    # Code change for Export2MQTT
+    parser.add_argument('-q', "--mqtt",       action="store_true",          help="Publish the records to the MQTT broker from export2mqtt.cfg while the readout is still running.")
     args = parser.parse_args()
 
     #setup logging
@@ -366,6 +419,7 @@ async def main():
         # Code change for Export2Garmin
         bleAddr = await selectBLEdevices(adapter=args.adapter)
     bleClient = bleak.BleakClient(bleAddr, adapter=args.adapter)
+    mqttPublisher = None
     try:
         logger.info(f"Attempt connecting to {bleAddr}.")
         await bleClient.connect()
@@ -386,10 +440,19 @@ async def main():
         else:
             logger.info("communication started")
             devSpecificDriver = deviceSpecific.deviceSpecificDriver()
-            allRecs = await devSpecificDriver.getRecords(btobj = bluetoothTxRxObj, useUnreadCounter = args.newRecOnly, syncTime = args.timeSync)
+
+            # Code change for Export2MQTT
+            publishTasks = []
+            onUserRecords = None
+            if(args.mqtt):
+                mqttPublisher, onUserRecords = await startMqttPublishing(publishTasks)
+            allRecs = await devSpecificDriver.getRecords(btobj = bluetoothTxRxObj, useUnreadCounter = args.newRecOnly, syncTime = args.timeSync, onUserRecords = onUserRecords)
             logger.info("communication finished")
-            appendCsv(allRecs)
+            uploadedRecords = dict(await asyncio.gather(*publishTasks))
+            appendCsv(allRecs, uploadedRecords)
     finally:
+        if mqttPublisher is not None:
+            await mqttPublisher.disconnect()
         logger.info("unpair and disconnect")
         if bleClient.is_connected:
             await bleClient.unpair()
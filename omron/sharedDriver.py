@@ -35,7 +35,9 @@ class sharedDeviceDriverCode():
         newUnreadRecordSettings = unreadRecordsSettingsCopy[:4] + resetUnreadRecordsBytes * 2 + unreadRecordsSettingsCopy[8:]
         self.cachedSettingsBytes[slice(*self.settingsUnreadRecordsBytes)] = newUnreadRecordSettings
     
-    async def getRecords(self, btobj, useUnreadCounter, syncTime):
+    async def getRecords(self, btobj, useUnreadCounter, syncTime, onUserRecords = None):
+        #onUserRecords(userIdx, records) is called as soon as the records of one user are parsed,
+        #e.g. to start publishing them while the ring buffer of the next user is still being read
         await btobj.unlockWithUnlockKey()
         await btobj.startTransmission()
         
@@ -73,6 +75,8 @@ class sharedDeviceDriverCode():
                     except:
                         logger.warning(f"Error parsing record for user{userIdx+1} at offset {recordStartOffset} data {bytes(singleRecordBytes).hex()}, ignoring this record.")
             allUserRecordsList.append(perUserAnalyzedRecordsList)
+            if(onUserRecords is not None):
+                onUserRecords(userIdx, perUserAnalyzedRecordsList)
             
         if(useUnreadCounter):
             self.resetUnreadRecordsCounter()